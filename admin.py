@@ -0,0 +1,36 @@
+"""
+Shared admin authorization for operational endpoints (profiling, bulk
+server import/export).
+
+Admin endpoints are disabled unless ADMIN_TOKEN is set; callers must send
+the token in the X-Admin-Token header.
+"""
+
+import functools
+import hmac
+import os
+
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+
+
+def check_admin(headers):
+    """Return None if authorized, else (error message, HTTP status)."""
+    if not ADMIN_TOKEN:
+        return "Not found", 404
+    if not hmac.compare_digest(headers.get(ADMIN_TOKEN_HEADER, ""), ADMIN_TOKEN):
+        return "Forbidden", 403
+    return None
+
+
+def admin_required(view):
+    """Flask decorator rejecting requests without a valid admin token."""
+    from flask import request, jsonify
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        denied = check_admin(request.headers)
+        if denied:
+            return jsonify({"error": denied[0]}), denied[1]
+        return view(*args, **kwargs)
+    return wrapper
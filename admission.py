@@ -0,0 +1,113 @@
+"""
+Admission control for the RC and hospital server Flask apps.
+
+Two layers protect each endpoint:
+- a token bucket per (client, endpoint) that rejects bursts above
+  RATE_LIMIT_RPS / RATE_LIMIT_BURST with 429 and a Retry-After hint. It is
+  off by default: behind the middleware every request arrives from the
+  same address, so the client is the X-Forwarded-For address only when the
+  peer is listed in TRUSTED_PROXIES, else the peer address itself;
+- a process-wide concurrency cap (MAX_CONCURRENT_REQUESTS) where excess
+  requests wait up to QUEUE_TIMEOUT seconds for a slot, then get 503.
+
+Rejected requests are answered before any SQLite or hashing work, so an
+overloaded service sheds load instead of queueing it without bound.
+"""
+
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request, jsonify
+
+RATE_LIMIT_RPS = float(os.environ.get("RATE_LIMIT_RPS", "0"))
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", "40"))
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS", "16"))
+QUEUE_TIMEOUT = float(os.environ.get("QUEUE_TIMEOUT", "2.0"))
+MAX_TRACKED_CLIENTS = 10000
+# Peers (e.g. the middleware) whose X-Forwarded-For is trusted to name the real client
+TRUSTED_PROXIES = {addr.strip() for addr in os.environ.get("TRUSTED_PROXIES", "").split(",") if addr.strip()}
+FORWARDED_FOR_HEADER = "X-Forwarded-For"
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Consume one token. Returns 0 on success, else seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token buckets keyed by (client, endpoint), LRU-bounded."""
+
+    def __init__(self, rate=RATE_LIMIT_RPS, burst=RATE_LIMIT_BURST, max_clients=MAX_TRACKED_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, client, endpoint):
+        key = (client, endpoint)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.take()
+
+
+def client_key(req):
+    """The address the rate limit applies to: the forwarded client behind a trusted proxy, else the peer."""
+    if req.remote_addr in TRUSTED_PROXIES:
+        # The last hop is the one our trusted proxy appended
+        forwarded = req.headers.get(FORWARDED_FOR_HEADER, "").split(",")[-1].strip()
+        if forwarded:
+            return forwarded
+    return req.remote_addr
+
+
+rate_limiter = RateLimiter()
+_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+
+def admission_controlled(endpoint):
+    """Decorator applying the per-client rate limit and the global concurrency cap."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if RATE_LIMIT_RPS > 0:
+                retry_after = rate_limiter.check(client_key(request), endpoint)
+                if retry_after:
+                    response = jsonify({"error": "Rate limit exceeded"})
+                    response.headers["Retry-After"] = str(max(1, int(retry_after + 0.999)))
+                    return response, 429
+
+            if not _slots.acquire(timeout=QUEUE_TIMEOUT):
+                response = jsonify({"error": "Service overloaded, try again later"})
+                response.headers["Retry-After"] = "1"
+                return response, 503
+            try:
+                return view(*args, **kwargs)
+            finally:
+                _slots.release()
+        return wrapper
+    return decorator
@@ -136,13 +136,60 @@ def print_detailed_breakdown(times_dict, operation_name):
     print("-" * 60)
 
     for metric, values in sorted(times_dict.items()):
-        if metric != 'TOTAL' and values:
+        # Remote phases (e.g. server.beta_check) are already inside server_comm / rc_comm
+        if metric != 'TOTAL' and '.' not in metric and values:
             avg_time = statistics.mean(values)
             percentage = (avg_time / avg_total) * 100
             print(f"{metric:<30} {avg_time:<15.3f} {percentage:<15.1f}%")
 
     print()
 
+def load_requests(log_file='performance_metrics.log'):
+    """Return the parsed log entries one per request, in log order."""
+    entries = []
+    try:
+        with open(log_file, 'r') as f:
+            for line in f:
+                parsed = parse_log_line(line.strip())
+                if parsed:
+                    entries.append(parsed)
+    except FileNotFoundError:
+        pass
+    return entries
+
+def print_cross_service_breakdown(entries, operation_name, comm_metric, service):
+    """
+    Split the middleware's view of a remote call (comm_metric) into the remote
+    service's own phases, as reported in its Server-Timing header, and the
+    remainder: network, HTTP client/server and framework overhead.
+    """
+    print(f"\n{'='*80}")
+    print(f"{operation_name} - CROSS-SERVICE BREAKDOWN ({comm_metric})")
+    print(f"{'='*80}\n")
+
+    remote_total = f"{service}.total"
+    requests = [e['metrics'] for e in entries
+                if operation_name in e['operation'] and comm_metric in e['metrics'] and remote_total in e['metrics']]
+    if not requests:
+        print(f"No requests with {service} Server-Timing data yet.\n")
+        return
+
+    remote_phases = sorted({key for metrics in requests for key in metrics
+                            if key.startswith(f"{service}.") and key != remote_total})
+    overhead = [m[comm_metric] - m[remote_total] for m in requests]
+
+    print(f"Correlated requests: {len(requests)}\n")
+    print(f"{'Component':<35} {'Avg (ms)':<12} {'Median (ms)':<12} {'% of ' + comm_metric:<15}")
+    print("-" * 80)
+    avg_comm = statistics.mean(m[comm_metric] for m in requests)
+    rows = [(phase, [m[phase] for m in requests if phase in m]) for phase in remote_phases]
+    rows.append((f"{remote_total} (inside {service})", [m[remote_total] for m in requests]))
+    rows.append(("network + HTTP overhead", overhead))
+    for label, values in rows:
+        avg_val = statistics.mean(values)
+        print(f"{label:<35} {avg_val:<12.3f} {statistics.median(values):<12.3f} {avg_val / avg_comm * 100:<15.1f}")
+    print()
+
 def main():
     """Main function to run the analysis."""
     print("\n" + "="*80)
@@ -162,6 +209,11 @@ def main():
     if reg_times and auth_times:
         print_comparison_table(reg_times, auth_times)
 
+    entries = load_requests()
+    if entries:
+        print_cross_service_breakdown(entries, "REGISTRATION", "rc_comm", "rc")
+        print_cross_service_breakdown(entries, "AUTHENTICATION", "server_comm", "server")
+
     print("\n" + "="*80)
     print("RESEARCH NOTES:")
     print("="*80)
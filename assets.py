@@ -0,0 +1,125 @@
+"""
+Precompressed, content-hashed UI assets for the middleware.
+
+At startup every asset is read once, compressed with gzip (and brotli when
+the optional `brotli` package is installed) and given a strong ETag.
+Static files are published under content-hashed names
+(/assets/app.<hash>.js) and index.html is rewritten to point at them, so
+they can be cached as immutable. index.html itself keeps its plain URL and
+is revalidated with If-None-Match, which costs a 304 and no body.
+"""
+
+import gzip
+import hashlib
+import os
+
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+MIN_COMPRESS_SIZE = 500
+
+CONTENT_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".js": "application/javascript; charset=utf-8",
+}
+
+
+class Asset:
+    __slots__ = ("content_type", "etag", "variants")
+
+    def __init__(self, body, content_type):
+        self.content_type = content_type
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        # encoding -> (body, ETag); each representation gets its own strong ETag
+        self.variants = {"identity": (body, f'"{self.etag}"')}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            self.variants["gzip"] = (gzip.compress(body, compresslevel=9, mtime=0), f'"{self.etag}-gz"')
+            if brotli is not None:
+                self.variants["br"] = (brotli.compress(body), f'"{self.etag}-br"')
+
+
+class AssetBundle:
+    def __init__(self, index_file="index.html", static_dir="static", static_files=("styles.css", "app.js")):
+        self.by_name = {}
+        self.index = None
+        urls = {}
+        for filename in static_files:
+            path = os.path.join(static_dir, filename)
+            try:
+                with open(path, "rb") as f:
+                    body = f.read()
+            except FileNotFoundError:
+                continue
+            stem, ext = os.path.splitext(filename)
+            asset = Asset(body, CONTENT_TYPES.get(ext, "application/octet-stream"))
+            hashed_name = f"{stem}.{asset.etag[:12]}{ext}"
+            self.by_name[hashed_name] = asset
+            urls[f"/{static_dir}/{filename}"] = f"/assets/{hashed_name}"
+
+        try:
+            with open(index_file, "r", encoding="utf-8") as f:
+                html = f.read()
+        except FileNotFoundError:
+            return
+        for plain_url, hashed_url in urls.items():
+            html = html.replace(f'"{plain_url}"', f'"{hashed_url}"')
+        self.index = Asset(html.encode("utf-8"), CONTENT_TYPES[".html"])
+
+
+def _parse_accept_encoding(accept_encoding):
+    """{coding: q} from an Accept-Encoding header; a malformed q counts as 0."""
+    weights = {}
+    for token in accept_encoding.lower().split(","):
+        coding, *params = [part.strip() for part in token.split(";")]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding] = q
+    return weights
+
+
+def _pick_encoding(asset, accept_encoding):
+    weights = _parse_accept_encoding(accept_encoding)
+    wildcard = weights.get("*", 0.0)
+    best, best_q = "identity", 0.0
+    for encoding in ("br", "gzip"):
+        q = weights.get(encoding, wildcard)
+        # q=0 means "not acceptable"; br wins ties
+        if encoding in asset.variants and q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def asset_response(asset, request, immutable):
+    """Serve the best precompressed variant, or 304 if the client's copy is current."""
+    encoding = _pick_encoding(asset, request.headers.get("accept-encoding", ""))
+    body, etag = asset.variants[encoding]
+    headers = {
+        "ETag": etag,
+        "Cache-Control": IMMUTABLE_CACHE if immutable else REVALIDATE_CACHE,
+        "Vary": "Accept-Encoding",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        client_tags = {tag.strip() for tag in if_none_match.split(",")}
+        if "*" in client_tags or client_tags & {tag for _, tag in asset.variants.values()}:
+            return Response(status_code=304, headers=headers)
+
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=asset.content_type, headers=headers)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Middleware behaviour under degraded dependencies.
+
+Starts fault proxies in front of the RC and the hospital server, then for
+each scenario drives the middleware with concurrent logins (or
+registrations) and reports throughput, latency percentiles, status codes
+and, with --middleware-pid, the middleware's RSS, threads and CPU time.
+
+    python rc.py & python server1.py &
+    RC_URL=http://127.0.0.1:6000 SERVER_URL=http://127.0.0.1:6001 UPSTREAM_TIMEOUT=2 \\
+        uvicorn middleware:app --port 8000 &
+    python bench_faults.py --middleware-pid $! --duration 20 --concurrency 16
+
+Scenarios are listed in SCENARIOS; pick some with --scenarios a,b,c.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import statistics
+import threading
+import time
+import uuid
+from collections import Counter
+from urllib.parse import urlsplit
+
+from fault_proxy import FaultConfig, make_proxy
+
+# Faults per dependency; anything not given is healthy
+SCENARIOS = {
+    "baseline": {},
+    "slow_server": {"server": {"latency": "lognormal:80:0.8"}},
+    "heavy_tail_server": {"server": {"latency": "pareto:10:1.5"}},
+    "server_5xx": {"server": {"error_rate": 0.1}},
+    "server_resets": {"server": {"reset_rate": 0.05}},
+    "server_stall": {"server": {"latency": "fixed:8000"}},
+    "slow_rc": {"rc": {"latency": "lognormal:100:0.5"}},
+    "rc_5xx": {"rc": {"error_rate": 0.2}},
+}
+HEALTHY = {"latency": "none", "error_rate": 0.0, "reset_rate": 0.0}
+
+
+def post_json(url, path, payload, timeout):
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+    try:
+        conn.request("POST", path, body=json.dumps(payload), headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def process_stats(pid):
+    """RSS (KiB), thread count and CPU seconds of a local process, from /proc. None if unavailable."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    return {"rss_kb": int(status["VmRSS"].split()[0]), "threads": int(status["Threads"]), "cpu_s": cpu}
+
+
+def run_load(args, operation, user):
+    latencies, statuses = [], Counter()
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    def worker():
+        while time.monotonic() < deadline:
+            if operation == "register":
+                payload, path = {"user_id": f"bench-{uuid.uuid4().hex[:12]}", "password": "bench"}, "/register_user"
+            else:
+                payload, path = user, "/authenticate_user"
+            start = time.perf_counter()
+            try:
+                status = post_json(args.middleware, path, payload, args.client_timeout)
+            except OSError as e:
+                status = type(e).__name__
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, statuses
+
+
+def report(name, latencies, statuses, duration, before, after):
+    ok = statuses.get(200, 0) + statuses.get(201, 0)
+    if len(latencies) >= 2:
+        q = statistics.quantiles(latencies, n=100, method="inclusive")
+        p50, p95, p99 = q[49], q[94], q[98]
+    else:
+        p50 = p95 = p99 = latencies[0] if latencies else 0.0
+    line = (f"{name:<18} {len(latencies) / duration:>8.1f} {ok / duration:>8.1f} "
+            f"{p50:>9.1f} {p95:>9.1f} {p99:>9.1f} {max(latencies, default=0):>9.1f}")
+    if before and after:
+        line += f" {after['rss_kb'] / 1024:>8.1f} {after['threads']:>7} {after['cpu_s'] - before['cpu_s']:>7.2f}"
+    print(line)
+    print(f"{'':<18} status: {dict(statuses)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Middleware throughput and tail latency under injected faults")
+    parser.add_argument("--middleware", default="http://127.0.0.1:8000")
+    parser.add_argument("--rc-upstream", default="http://127.0.0.1:5000")
+    parser.add_argument("--server-upstream", default="http://127.0.0.1:5001")
+    parser.add_argument("--rc-proxy-port", type=int, default=6000)
+    parser.add_argument("--server-proxy-port", type=int, default=6001)
+    parser.add_argument("--operation", choices=["authenticate", "register"], default="authenticate")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--client-timeout", type=float, default=30.0)
+    parser.add_argument("--middleware-pid", type=int, help="Report RSS/threads/CPU of this process")
+    args = parser.parse_args()
+
+    faults = {"rc": FaultConfig(), "server": FaultConfig()}
+    proxies = [make_proxy(args.rc_upstream, args.rc_proxy_port, faults["rc"]),
+               make_proxy(args.server_upstream, args.server_proxy_port, faults["server"])]
+    for proxy in proxies:
+        threading.Thread(target=proxy.serve_forever, daemon=True).start()
+
+    user = None
+    if args.operation == "authenticate":
+        user = {"user_id": f"bench-{uuid.uuid4().hex[:12]}", "password": "bench"}
+        status = post_json(args.middleware, "/register_user", user, args.client_timeout)
+        if status != 201:
+            raise SystemExit(f"Could not register the benchmark user through the middleware (HTTP {status})")
+
+    print(f"\n{'='*110}")
+    print(f"FAULT SCENARIOS: {args.operation}, {args.concurrency} clients, {args.duration:.0f}s each")
+    print(f"{'='*110}\n")
+    header = f"{'Scenario':<18} {'req/s':>8} {'ok/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    if args.middleware_pid:
+        header += f" {'RSS MiB':>8} {'threads':>7} {'CPU s':>7}"
+    print(header)
+    print("-" * 110)
+
+    try:
+        for name in args.scenarios.split(","):
+            scenario = SCENARIOS[name]
+            for dependency, config in faults.items():
+                config.update({**HEALTHY, **scenario.get(dependency, {})})
+            before = process_stats(args.middleware_pid) if args.middleware_pid else None
+            latencies, statuses = run_load(args, args.operation, user)
+            after = process_stats(args.middleware_pid) if args.middleware_pid else None
+            report(name, latencies, statuses, args.duration, before, after)
+    finally:
+        for proxy in proxies:
+            proxy.shutdown()
+    print()
+
+
+if __name__ == "__main__":
+    main()
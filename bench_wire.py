@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Wire-format benchmark: bytes on the wire and serialization CPU per message.
+
+Compares JSON (the default), the fixed-layout binary format and, when the
+msgpack package is installed, msgpack, using realistic protocol payloads.
+
+    python3 bench_wire.py [iterations]
+"""
+
+import hashlib
+import secrets
+import sys
+import time
+
+import wire
+
+
+def h():
+    return hashlib.sha256(secrets.token_bytes(16)).hexdigest()
+
+
+def sample_messages(servers=3):
+    T1 = str(int(time.time()))
+    List_sj = [f"hospital{i}.{h()}.Goa" for i in range(servers)]
+    VT_ij = h()
+    return {
+        "authenticate_request": {"alpha_i": h(), "beta_i": h(), "T1": T1, "C_i": h(), "UID_i": h(), "ID_j": "hospital2"},
+        "authenticate_response": {"gamma_i": hex(int(VT_ij + "Goa".encode().hex(), 16) ^ int(h(), 16))[2:].zfill(64),
+                                  "sigma_i": h(), "T2": T1},
+        "register_user_request": {"UID_i": h(), "A_i": h()},
+        "register_user_response": {"C_i": h(), "D_i": h(), "List_sj": List_sj, "List_sj_version": 7},
+        "register_server_request": {"ID_j": "hospital2", "P_j": h(), "Q_j": h(), "Loc_j": "Goa"},
+        "register_server_response": {"SSK_j": h()},
+    }
+
+
+def time_per_call(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    formats = ["json", "binary"] + (["msgpack"] if wire.msgpack is not None else [])
+
+    print(f"\n{'='*80}")
+    print(f"WIRE FORMAT BENCHMARK ({iterations} iterations per cell)")
+    print(f"{'='*80}\n")
+    print(f"{'Message':<26} {'Format':<9} {'Bytes':<8} {'Encode (us)':<13} {'Decode (us)':<13}")
+    print("-" * 80)
+
+    for schema, payload in sample_messages().items():
+        for fmt in formats:
+            body = wire.encode(fmt, schema, payload)
+            assert wire.decode(fmt, schema, body) == payload, f"{fmt} round trip failed for {schema}"
+            encode_us = time_per_call(lambda: wire.encode(fmt, schema, payload), iterations)
+            decode_us = time_per_call(lambda: wire.decode(fmt, schema, body), iterations)
+            print(f"{schema:<26} {fmt:<9} {len(body):<8} {encode_us:<13.2f} {decode_us:<13.2f}")
+        print()
+
+    if wire.msgpack is None:
+        print("msgpack not installed; install it to include msgpack in the comparison.\n")
+
+
+if __name__ == "__main__":
+    main()
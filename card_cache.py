@@ -0,0 +1,85 @@
+"""
+Short-lived cache of unlocked smart-card material for the middleware.
+
+After a successful login the values derived from the card that do not
+depend on T1 (UID_i, C_i, List_sj) are kept for CARD_CACHE_TTL seconds,
+keyed by ID_i. An entry is only returned to a caller presenting the same
+password: it stores an HMAC of (ID_i, PW_i) under a per-process random
+key, never the password, and compares it in constant time. A repeat
+login then only computes alpha_i/beta_i.
+
+Entries hold their secrets in bytearrays, which are overwritten with
+zeros when an entry expires, is evicted (LRU, CARD_CACHE_SIZE entries) or
+is invalidated by a re-registration. Transient str copies made while a
+request uses the values are outside the cache's control.
+"""
+
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Entry:
+    __slots__ = ("verifier", "expires", "UID_i", "C_i", "List_sj")
+
+    def __init__(self, verifier, expires, UID_i, C_i, List_sj):
+        self.verifier = bytearray(verifier)
+        self.expires = expires
+        self.UID_i = bytearray(UID_i.encode())
+        self.C_i = bytearray(C_i.encode())
+        self.List_sj = bytearray(";".join(List_sj).encode())
+
+    def wipe(self):
+        for buf in (self.verifier, self.UID_i, self.C_i, self.List_sj):
+            buf[:] = bytes(len(buf))
+
+
+class CardCache:
+    def __init__(self, ttl, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._key = secrets.token_bytes(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _verifier(self, ID_i, PW_i):
+        return hmac.new(self._key, (ID_i + "\0" + PW_i).encode(), hashlib.sha256).digest()
+
+    def _drop(self, ID_i):
+        entry = self._entries.pop(ID_i, None)
+        if entry is not None:
+            entry.wipe()
+
+    def get(self, ID_i, PW_i):
+        """Return (UID_i, C_i, List_sj) for a matching, unexpired entry, else None."""
+        verifier = self._verifier(ID_i, PW_i)
+        with self._lock:
+            entry = self._entries.get(ID_i)
+            if entry is None:
+                return None
+            if entry.expires <= time.monotonic():
+                self._drop(ID_i)
+                return None
+            if not hmac.compare_digest(bytes(entry.verifier), verifier):
+                return None
+            self._entries.move_to_end(ID_i)
+            return entry.UID_i.decode(), entry.C_i.decode(), entry.List_sj.decode().split(";")
+
+    def put(self, ID_i, PW_i, UID_i, C_i, List_sj):
+        entry = _Entry(self._verifier(ID_i, PW_i), time.monotonic() + self.ttl, UID_i, C_i, List_sj)
+        with self._lock:
+            now = time.monotonic()
+            for expired_id in [key for key, old in self._entries.items() if old.expires <= now]:
+                self._drop(expired_id)
+            self._drop(ID_i)
+            self._entries[ID_i] = entry
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                evicted.wipe()
+
+    def invalidate(self, ID_i):
+        with self._lock:
+            self._drop(ID_i)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Fault-injecting reverse proxy for the RC and hospital server.
+
+Put it between the middleware (or server1.py) and a real upstream to
+simulate a slow or unreliable dependency:
+
+    python fault_proxy.py --upstream http://127.0.0.1:5001 --port 6001 \\
+        --latency lognormal:40:0.6 --error-rate 0.05 --reset-rate 0.01
+    SERVER_URL=http://127.0.0.1:6001 uvicorn middleware:app --port 8000
+
+Per request, in order: sleep for a sample of the latency distribution,
+then with --reset-rate abort the connection (TCP RST, no response), with
+--error-rate answer 503 without calling the upstream, otherwise forward.
+
+Latency specs (all in ms):
+    none | fixed:MS | uniform:LO:HI | normal:MEAN:STDDEV
+    lognormal:MEDIAN:SIGMA | pareto:MIN:ALPHA
+
+The faults can be changed while the proxy runs, without restarting it:
+
+    curl -X POST localhost:6001/__fault__ -d '{"latency": "fixed:500", "error_rate": 0.2}'
+    curl localhost:6001/__fault__
+"""
+
+import argparse
+import http.client
+import json
+import math
+import random
+import socket
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+CONTROL_PATH = "/__fault__"
+HOP_BY_HOP = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+              "te", "trailers", "transfer-encoding", "upgrade", "host", "content-length"}
+
+
+def parse_latency(spec):
+    """Return a function sampling a delay in seconds from a latency spec."""
+    kind, _, params = (spec or "none").partition(":")
+    args = [float(p) for p in params.split(":")] if params else []
+    samplers = {
+        "none": (0, lambda: 0.0),
+        "fixed": (1, lambda: args[0]),
+        "uniform": (2, lambda: random.uniform(args[0], args[1])),
+        "normal": (2, lambda: random.gauss(args[0], args[1])),
+        "lognormal": (2, lambda: random.lognormvariate(math.log(args[0]), args[1])),
+        "pareto": (2, lambda: args[0] * random.paretovariate(args[1])),
+    }
+    if kind not in samplers or len(args) != samplers[kind][0]:
+        raise ValueError(f"Invalid latency spec {spec!r}")
+    sample = samplers[kind][1]
+    return lambda: max(sample(), 0.0) / 1000
+
+
+class FaultConfig:
+    def __init__(self, latency="none", error_rate=0.0, reset_rate=0.0):
+        self._lock = threading.Lock()
+        self.update({"latency": latency, "error_rate": error_rate, "reset_rate": reset_rate})
+
+    def update(self, changes):
+        latency = changes.get("latency", getattr(self, "latency", "none"))
+        sampler = parse_latency(latency)
+        error_rate = float(changes.get("error_rate", getattr(self, "error_rate", 0.0)))
+        reset_rate = float(changes.get("reset_rate", getattr(self, "reset_rate", 0.0)))
+        if not (0 <= error_rate <= 1 and 0 <= reset_rate <= 1):
+            raise ValueError("Rates must be between 0 and 1")
+        with self._lock:
+            self.latency, self.sample_delay = latency, sampler
+            self.error_rate, self.reset_rate = error_rate, reset_rate
+
+    def as_dict(self):
+        with self._lock:
+            return {"latency": self.latency, "error_rate": self.error_rate, "reset_rate": self.reset_rate}
+
+
+class FaultProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    upstream = None  # urlsplit() of the upstream base URL
+    faults = None
+    timeout_s = 30.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else None
+
+    def _reset(self):
+        # SO_LINGER with a zero timeout makes close() send RST instead of FIN
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        self.close_connection = True
+        self.connection.close()
+
+    def _control(self, body):
+        if self.command == "POST":
+            try:
+                self.faults.update(json.loads(body or b"{}"))
+            except (ValueError, TypeError, AttributeError) as e:
+                return self._send(400, json.dumps({"error": str(e)}).encode())
+        self._send(200, json.dumps(self.faults.as_dict()).encode())
+
+    def _proxy(self):
+        body = self._read_body()
+        if self.path == CONTROL_PATH:
+            return self._control(body)
+
+        faults = self.faults
+        time.sleep(faults.sample_delay())
+        if random.random() < faults.reset_rate:
+            return self._reset()
+        if random.random() < faults.error_rate:
+            return self._send(503, b'{"error": "Injected fault"}')
+
+        headers = {k: v for k, v in self.headers.items() if k.lower() not in HOP_BY_HOP}
+        conn = http.client.HTTPConnection(self.upstream.hostname, self.upstream.port or 80, timeout=self.timeout_s)
+        try:
+            conn.request(self.command, self.upstream.path.rstrip("/") + self.path, body=body, headers=headers)
+            upstream = conn.getresponse()
+            payload = upstream.read()
+        except OSError as e:
+            return self._send(502, json.dumps({"error": f"Upstream unreachable: {e}"}).encode())
+        finally:
+            conn.close()
+
+        self.send_response(upstream.status)
+        for key, value in upstream.getheaders():
+            if key.lower() not in HOP_BY_HOP:
+                self.send_header(key, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _proxy
+
+
+def make_proxy(upstream, port, faults, host="127.0.0.1"):
+    """Build (but do not start) a proxy server; call serve_forever() on the result."""
+    handler = type("BoundFaultProxyHandler", (FaultProxyHandler,),
+                   {"upstream": urlsplit(upstream), "faults": faults})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fault-injecting reverse proxy")
+    parser.add_argument("--upstream", required=True, help="e.g. http://127.0.0.1:5000")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--latency", default="none", help="Latency spec, e.g. lognormal:40:0.6")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction answered with 503")
+    parser.add_argument("--reset-rate", type=float, default=0.0, help="Fraction of connections reset")
+    args = parser.parse_args()
+
+    faults = FaultConfig(args.latency, args.error_rate, args.reset_rate)
+    server = make_proxy(args.upstream, args.port, faults, args.host)
+    print(f"Proxying {args.host}:{args.port} -> {args.upstream} with {faults.as_dict()}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
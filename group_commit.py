@@ -0,0 +1,110 @@
+"""
+Group-commit writer for SQLite.
+
+Concurrent callers submit single-row writes; a background thread gathers
+everything that arrives within a short window and applies it in one
+transaction, so N registrations cost one fsync instead of N. submit()
+blocks until the transaction holding the caller's row has committed, so
+a caller that gets a result back has the same durability as a direct
+INSERT + commit.
+
+Any failure in the writer thread, including connecting, is reported to
+the callers whose batch it hit. The connection is then reopened for the
+next batch, so one bad batch never leaves later submit() calls waiting.
+submit() still gives up after SUBMIT_TIMEOUT seconds. Its row may yet
+commit after that.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+MAX_BATCH_SIZE = 512
+SUBMIT_TIMEOUT = float(os.environ.get("GROUP_COMMIT_TIMEOUT", "30"))  # seconds a caller waits for its batch
+
+
+class _PendingWrite:
+    __slots__ = ("sql", "params", "done", "error")
+
+    def __init__(self, sql, params):
+        self.sql = sql
+        self.params = params
+        self.done = threading.Event()
+        self.error = None
+
+
+class GroupCommitWriter:
+    def __init__(self, db_path, window_ms=5.0, max_batch=MAX_BATCH_SIZE):
+        self.db_path = db_path
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name=f"group-commit:{db_path}", daemon=True)
+        self._thread.start()
+
+    def submit(self, sql, params=(), timeout=SUBMIT_TIMEOUT):
+        """Queue one statement and wait until it is durable. Re-raises its error, if any."""
+        pending = _PendingWrite(sql, params)
+        self._queue.put(pending)
+        if not pending.done.wait(timeout):
+            raise sqlite3.OperationalError(f"Group commit to {self.db_path} timed out after {timeout}s")
+        if pending.error is not None:
+            raise pending.error
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    def _write(self, conn, batch):
+        conn.execute("BEGIN IMMEDIATE")
+        for pending in batch:
+            try:
+                conn.execute(pending.sql, pending.params)
+            except sqlite3.Error as e:
+                # A failed statement (e.g. a duplicate key) normally aborts only itself,
+                # and only this caller sees the error.
+                pending.error = e
+                if not conn.in_transaction:
+                    # SQLite rolled back the whole transaction (SQLITE_FULL, IOERR, NOMEM...):
+                    # earlier rows are gone, and later ones must not autocommit one by one.
+                    raise
+        conn.execute("COMMIT")
+
+    def _run(self):
+        conn = None
+        while True:
+            batch = self._collect()
+            try:
+                if conn is None:
+                    conn = self._connect()
+                self._write(conn, batch)
+            except Exception as e:
+                for pending in batch:
+                    pending.error = pending.error or e
+                # Nothing in this batch committed; start the next one on a fresh connection
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                conn = None
+            finally:
+                for pending in batch:
+                    pending.done.set()
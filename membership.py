@@ -0,0 +1,88 @@
+"""
+In-memory membership index for registered identifiers (UID_i, ID_j).
+
+The RC loads every registered key at startup and keeps the index in sync
+on insert, so duplicate registrations are rejected without a SELECT.
+Indexes larger than RC_INDEX_EXACT_LIMIT keys switch from an exact set to
+a Bloom filter; a Bloom hit is confirmed against SQLite through the
+`lookup` callback, while a miss is trusted (Bloom filters have no false
+negatives).
+
+reserve() is atomic, so two concurrent requests for the same key cannot
+both pass the check: the loser sees the winner's pending reservation.
+"""
+
+import hashlib
+import math
+import os
+import threading
+
+RC_INDEX_EXACT_LIMIT = int(os.environ.get("RC_INDEX_EXACT_LIMIT", "1000000"))
+BLOOM_ERROR_RATE = 0.01
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=BLOOM_ERROR_RATE):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class MembershipIndex:
+    def __init__(self, keys=(), lookup=None, exact_limit=RC_INDEX_EXACT_LIMIT):
+        keys = list(keys)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._lookup = lookup
+        if lookup is not None and len(keys) > exact_limit:
+            self._keys = None
+            self._bloom = BloomFilter(capacity=2 * len(keys))
+            for key in keys:
+                self._bloom.add(key)
+        else:
+            self._keys = set(keys)
+            self._bloom = None
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._known(key)
+
+    def _known(self, key):
+        if self._keys is not None:
+            return key in self._keys
+        return key in self._bloom and self._lookup(key)
+
+    def reserve(self, key):
+        """Claim `key` for an insert. Returns False if it is registered or being registered."""
+        with self._lock:
+            if key in self._pending or self._known(key):
+                return False
+            self._pending.add(key)
+            return True
+
+    def commit(self, key):
+        """Record a reserved key as registered once its row is written."""
+        with self._lock:
+            self._pending.discard(key)
+            if self._keys is not None:
+                self._keys.add(key)
+            else:
+                self._bloom.add(key)
+
+    def release(self, key):
+        """Drop a reservation whose insert did not happen. No-op after commit()."""
+        with self._lock:
+            self._pending.discard(key)
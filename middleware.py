@@ -1,16 +1,29 @@
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 import hashlib, secrets, time, requests, json, os, logging
 from datetime import datetime
+import tracing
+import wire
+import profiling
+import admin
+from smartcard import SmartCard, CardStore
+from assets import AssetBundle, asset_response
+from card_cache import CardCache
 
 # === CONFIGURATION ===
 RC_URL = os.environ.get("RC_URL", "http://127.0.0.1:5000")      # Registration Center
 SERVER_URL = os.environ.get("SERVER_URL", "http://127.0.0.1:5001")  # Hospital Server
-USER_DATA_FILE = "user_data.json"
+USER_DATA_FILE = "user_data.json"  # Legacy single-card JSON, read only as a fallback
+CARD_STORE_FILE = os.environ.get("CARD_STORE_FILE", "smartcards.bin")
+CARD_CACHE_TTL = float(os.environ.get("CARD_CACHE_TTL", "0"))  # seconds to keep unlocked card material; 0 = off
+CARD_CACHE_SIZE = int(os.environ.get("CARD_CACHE_SIZE", "1024"))
 PERFORMANCE_LOG_FILE = "performance_metrics.log"
+WIRE_FORMAT = wire.check_format(os.environ.get("WIRE_FORMAT", "json"))  # json | binary | msgpack, for calls to the RC and server
+UPSTREAM_TIMEOUT = float(os.environ.get("UPSTREAM_TIMEOUT", "5"))  # seconds, per call to the RC or server
+FORWARDED_FOR_HEADER = "X-Forwarded-For"  # end-client address for the RC/server rate limits (admission.py)
 
 # === PERFORMANCE LOGGING SETUP ===
 perf_logger = logging.getLogger("performance")
@@ -35,20 +48,15 @@ app.add_middleware(
 # Add GZip compression for faster response times
 app.add_middleware(GZipMiddleware, minimum_size=500)
 
+# Binary smart cards, memory-mapped and indexed by h(ID_i)
+card_store = CardStore(CARD_STORE_FILE)
+card_cache = CardCache(CARD_CACHE_TTL, CARD_CACHE_SIZE) if CARD_CACHE_TTL > 0 else None
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Cache HTML in memory for faster loading
-_HTML_CACHE = None
-def get_cached_html():
-    global _HTML_CACHE
-    if _HTML_CACHE is None:
-        try:
-            with open("index.html", "r") as f:
-                _HTML_CACHE = f.read()
-        except FileNotFoundError:
-            _HTML_CACHE = ""
-    return _HTML_CACHE
+# UI assets, compressed once at startup and served under content-hashed /assets/ URLs
+UI_ASSETS = AssetBundle()
 
 # ====================== UTILITY FUNCTIONS ======================
 def calculate_A_i(ID_i, PW_i):
@@ -72,7 +80,7 @@ def compute_z_i(r1, r2, ID_i, PW_i, list_sj_str):
 def extract_list_sj_from_z(Z_i, r1, r2, ID_i, PW_i):
     h1 = hashlib.sha256((r1 + ID_i + PW_i).encode()).hexdigest()
     h2 = hashlib.sha256((ID_i + PW_i + r2).encode()).hexdigest()
-    list_sj_int = int(Z_i, 16) ^ int(h1, 16) ^ int(h2, 16)
+    list_sj_int = Z_i ^ int(h1, 16) ^ int(h2, 16)
     try:
         s_bytes = bytes.fromhex(hex(list_sj_int)[2:].zfill(64))
         return s_bytes.decode("utf-8", errors="ignore").strip().split(";")
@@ -88,9 +96,16 @@ def extract_server_details(List_sj, target_server_id):
                 return SSK_j, Loc_j
     return None, None
 
-def save_user_data(data):
-    with open(USER_DATA_FILE, "w") as f:
-        json.dump(data, f)
+def remote_timings(response, service):
+    """Format a downstream Server-Timing header as perf-log fields, e.g. ' | server.ssk_lookup=0.002ms'."""
+    timings = tracing.parse_server_timing(response.headers.get(tracing.TIMING_HEADER))
+    return "".join(f" | {service}.{name}={ms:.3f}ms" for name, ms in timings.items())
+
+def upstream_failure(trace, service, error):
+    """504 for an RC/server timeout, 502 for a refused, reset or malformed upstream response."""
+    status = 504 if isinstance(error, requests.exceptions.Timeout) else 502
+    trace.finish(status)
+    return JSONResponse({"error": f"{service} unavailable: {error}"}, status_code=status)
 
 def load_user_data():
     try:
@@ -103,6 +118,10 @@ def load_user_data():
 @app.post("/register_user")
 async def register_user(req: Request):
     t_start = time.perf_counter()
+    trace = tracing.start_trace("middleware", "register_user", tracing.new_request_id())
+    correlation = {tracing.REQUEST_ID_HEADER: trace.trace_id} if trace.trace_id else {}
+    if req.client:
+        correlation[FORWARDED_FOR_HEADER] = req.client.host
     data = await req.json()
     ID_i = data.get("user_id")
     PW_i = data.get("password")
@@ -118,19 +137,33 @@ async def register_user(req: Request):
         A_i = calculate_A_i(ID_i, PW_i)
         B_i = calculate_B_i(r1, r2, PW_i)
         t_initial = (time.perf_counter() - t1) * 1000  # Convert to ms
+        trace.record("initial_comp", t_initial)
 
         # Phase 2: RC communication
         t2 = time.perf_counter()
         rc_payload = {"UID_i": UID_i, "A_i": A_i}
-        rc_response = requests.post(f"{RC_URL}/register_user", json=rc_payload)
+        rc_request = wire.request_kwargs(WIRE_FORMAT, "register_user", rc_payload)
+        rc_request["headers"].update(correlation)
+        rc_response = requests.post(f"{RC_URL}/register_user", timeout=UPSTREAM_TIMEOUT, **rc_request)
         if rc_response.status_code != 201:
+            trace.finish(rc_response.status_code)
             return JSONResponse({"error": "RC registration failed"}, status_code=rc_response.status_code)
-        rc_data = rc_response.json()
+        try:
+            rc_data = wire.read_response(rc_response, "register_user")
+            int(rc_data["C_i"], 16), int(rc_data["D_i"], 16)
+        except (ValueError, KeyError, TypeError) as e:
+            return upstream_failure(trace, "RC", e)
+        rc_timings = remote_timings(rc_response, "rc")
         t_rc_comm = (time.perf_counter() - t2) * 1000
+        trace.record("rc_comm", t_rc_comm)
 
         # Phase 3: Smartcard computation
         t3 = time.perf_counter()
         List_sj = rc_data.get("List_sj", [])
+        if not List_sj:
+            # Z_i encodes List_sj; an empty one cannot be stored on the card
+            trace.finish(503)
+            return JSONResponse({"error": "No live servers are available; try again later"}, status_code=503)
         list_sj_str = ";".join(List_sj)
 
         Z_i = compute_z_i(r1, r2, ID_i, PW_i, list_sj_str)
@@ -146,13 +179,17 @@ async def register_user(req: Request):
         E_i = hashlib.sha256((UID_i + PW_i + USK_i).encode()).hexdigest()
 
         SmartCard_i = {"W_i": W_i, "X_i": X_i, "Y_i": Y_i, "Z_i": Z_i, "E_i": E_i}
-        save_user_data(SmartCard_i)
+        card_store.put(ID_i, SmartCard.from_hex(SmartCard_i))
+        if card_cache:
+            card_cache.invalidate(ID_i)
         t_smartcard = (time.perf_counter() - t3) * 1000
+        trace.record("smartcard_comp", t_smartcard)
+        trace.finish(201)
 
         t_total = (time.perf_counter() - t_start) * 1000
 
         # Log performance metrics
-        perf_logger.info(f"REGISTRATION | user={ID_i} | initial_comp={t_initial:.3f}ms | rc_comm={t_rc_comm:.3f}ms | smartcard_comp={t_smartcard:.3f}ms | TOTAL={t_total:.3f}ms")
+        perf_logger.info(f"REGISTRATION | user={ID_i} | request_id={trace.trace_id} | initial_comp={t_initial:.3f}ms | rc_comm={t_rc_comm:.3f}ms | smartcard_comp={t_smartcard:.3f}ms{rc_timings} | TOTAL={t_total:.3f}ms")
 
         return JSONResponse({
             "message": "User registered successfully",
@@ -160,7 +197,10 @@ async def register_user(req: Request):
             "E_i": E_i,
             "SmartCard": SmartCard_i
         }, status_code=201)
+    except requests.exceptions.RequestException as e:
+        return upstream_failure(trace, "RC", e)
     except Exception as e:
+        trace.finish(500)
         return JSONResponse({"error": str(e)}, status_code=500)
 
 
@@ -168,95 +208,128 @@ async def register_user(req: Request):
 @app.post("/authenticate_user")
 async def authenticate_user(req: Request):
     t_start = time.perf_counter()
+    trace = tracing.start_trace("middleware", "authenticate_user", tracing.new_request_id())
+    correlation = {tracing.REQUEST_ID_HEADER: trace.trace_id} if trace.trace_id else {}
+    if req.client:
+        correlation[FORWARDED_FOR_HEADER] = req.client.host
     data = await req.json()
     ID_i = data.get("user_id")
     PW_i = data.get("password")
 
     # Phase 1: Smartcard loading and initial computations
     t1 = time.perf_counter()
-    SmartCard_i = load_user_data()
-    if not SmartCard_i:
-        return JSONResponse({"error": "Smartcard not found. Please register first."}, status_code=404)
-
-    W_i, X_i, Y_i, Z_i, E_i = (SmartCard_i[k] for k in ["W_i", "X_i", "Y_i", "Z_i", "E_i"])
-    A_i = calculate_A_i(ID_i, PW_i)
-    r1r2 = int(W_i, 16) ^ int(A_i, 16)
-    # Fix: Need to decode UTF-8 to get original r1+r2 string, not convert to hex
-    r1r2_hex = hex(r1r2)[2:]
-    # Pad to even length for bytes.fromhex
-    if len(r1r2_hex) % 2 == 1:
-        r1r2_hex = '0' + r1r2_hex
-    r1r2_bytes = bytes.fromhex(r1r2_hex)
-    r1r2_str = r1r2_bytes.decode('utf-8', errors='ignore')
-    r1, r2 = r1r2_str[:32], r1r2_str[32:]
+    unlocked = card_cache.get(ID_i, PW_i) if card_cache else None
+    if unlocked is None:
+        card = card_store.get(ID_i)
+        if card is None:
+            legacy_card = load_user_data()
+            card = SmartCard.from_hex(legacy_card) if legacy_card else None
+        if card is None:
+            trace.finish(404)
+            return JSONResponse({"error": "Smartcard not found. Please register first."}, status_code=404)
+
+        A_i = calculate_A_i(ID_i, PW_i)
+        r1r2 = card.W_i ^ int(A_i, 16)
+        # Fix: Need to decode UTF-8 to get original r1+r2 string, not convert to hex
+        r1r2_hex = hex(r1r2)[2:]
+        # Pad to even length for bytes.fromhex
+        if len(r1r2_hex) % 2 == 1:
+            r1r2_hex = '0' + r1r2_hex
+        r1r2_bytes = bytes.fromhex(r1r2_hex)
+        r1r2_str = r1r2_bytes.decode('utf-8', errors='ignore')
+        r1, r2 = r1r2_str[:32], r1r2_str[32:]
     t_smartcard_load = (time.perf_counter() - t1) * 1000
+    trace.record("smartcard_load", t_smartcard_load)
 
     # Phase 2: Credential verification
     t2 = time.perf_counter()
-    UID_i = hashlib.sha256((r1 + ID_i + r2).encode()).hexdigest()
-    B_i = calculate_B_i(r1, r2, PW_i)
-    D_i = hex(int(Y_i, 16) ^ int(B_i, 16))[2:].zfill(64)
-    USK_i = hex(int(A_i, 16) ^ int(D_i, 16))[2:].zfill(64)
-    E_i_computed = hashlib.sha256((UID_i + PW_i + USK_i).encode()).hexdigest()
-
-    # Debug logging
-    print(f"[DEBUG] user_id={ID_i}")
-    print(f"[DEBUG] r1={r1[:16]}... r2={r2[:16]}...")
-    print(f"[DEBUG] A_i={A_i[:16]}...")
-    print(f"[DEBUG] E_i_stored={E_i[:16]}...")
-    print(f"[DEBUG] E_i_computed={E_i_computed[:16]}...")
-    print(f"[DEBUG] Match: {E_i_computed == E_i}")
-
-    if E_i_computed != E_i:
-        return JSONResponse({"error": "Invalid credentials. Please check your user ID and password."}, status_code=401)
+    if unlocked is None:
+        UID_i = hashlib.sha256((r1 + ID_i + r2).encode()).hexdigest()
+        B_i = calculate_B_i(r1, r2, PW_i)
+        D_i = hex(card.Y_i ^ int(B_i, 16))[2:].zfill(64)
+        USK_i = hex(int(A_i, 16) ^ int(D_i, 16))[2:].zfill(64)
+        E_i_computed = hashlib.sha256((UID_i + PW_i + USK_i).encode()).digest()
+
+        if E_i_computed != card.E_i:
+            trace.finish(401)
+            return JSONResponse({"error": "Invalid credentials. Please check your user ID and password."}, status_code=401)
+
+        # Card material that does not depend on T1, reusable by later logins
+        List_sj = extract_list_sj_from_z(card.Z_i, r1, r2, ID_i, PW_i)
+        r2_id = hashlib.sha256((r2 + ID_i).encode()).hexdigest()
+        r1_pw = hashlib.sha256((r1 + PW_i).encode()).hexdigest()
+        C_i = hex(card.X_i ^ int(r2_id, 16) ^ int(r1_pw, 16))[2:].zfill(64)
+        if card_cache:
+            card_cache.put(ID_i, PW_i, UID_i, C_i, List_sj)
+    else:
+        UID_i, C_i, List_sj = unlocked
     t_credential_verify = (time.perf_counter() - t2) * 1000
+    trace.record("credential_verify", t_credential_verify)
 
     # Phase 3: Server lookup
     t3 = time.perf_counter()
-    List_sj = extract_list_sj_from_z(Z_i, r1, r2, ID_i, PW_i)
-    rc_info = requests.get(SERVER_URL).json()
-    ID_j = rc_info["creds"]["ID_j"]
+    try:
+        server_info = requests.get(SERVER_URL, headers=correlation, timeout=UPSTREAM_TIMEOUT)
+        server_info.raise_for_status()
+        ID_j = server_info.json()["creds"]["ID_j"]
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        return upstream_failure(trace, "Server", e)
     SSK_j, Loc_j = extract_server_details(List_sj, ID_j)
     if not SSK_j:
+        trace.finish(404)
         return JSONResponse({"error": f"Server {ID_j} not found in List_sj"}, status_code=404)
     t_server_lookup = (time.perf_counter() - t3) * 1000
+    trace.record("server_lookup", t_server_lookup)
 
     # Phase 4: Authentication message preparation
     t4 = time.perf_counter()
     T1 = str(int(time.time()))
     h1 = hashlib.sha256((ID_j + SSK_j + T1).encode()).hexdigest()
     alpha_i = hex(int(UID_i, 16) ^ int(h1, 16))[2:].zfill(64)
-    r2_id = hashlib.sha256((r2 + ID_i).encode()).hexdigest()
-    r1_pw = hashlib.sha256((r1 + PW_i).encode()).hexdigest()
-    C_i = hex(int(X_i, 16) ^ int(r2_id, 16) ^ int(r1_pw, 16))[2:].zfill(64)
     beta_i = hashlib.sha256((UID_i + SSK_j + C_i + T1).encode()).hexdigest()
     t_msg_prep = (time.perf_counter() - t4) * 1000
+    trace.record("msg_prep", t_msg_prep)
 
     # Phase 5: Server communication
     t5 = time.perf_counter()
     payload = {"alpha_i": alpha_i, "beta_i": beta_i, "T1": T1, "C_i": C_i, "UID_i": UID_i, "ID_j": ID_j}
-    res = requests.post(f"{SERVER_URL}/authenticate", json=payload)
+    server_request = wire.request_kwargs(WIRE_FORMAT, "authenticate", payload)
+    server_request["headers"].update(correlation)
+    try:
+        res = requests.post(f"{SERVER_URL}/authenticate", timeout=UPSTREAM_TIMEOUT, **server_request)
+    except requests.exceptions.RequestException as e:
+        return upstream_failure(trace, "Server", e)
     if res.status_code != 200:
+        trace.finish(res.status_code)
         return JSONResponse({"error": res.text}, status_code=res.status_code)
     t_server_comm = (time.perf_counter() - t5) * 1000
+    server_timings = remote_timings(res, "server")
+    trace.record("server_comm", t_server_comm)
 
     # Phase 6: Response verification and session key computation
     t6 = time.perf_counter()
-    data = res.json()
-    gamma_i, sigma_i, T2 = data["gamma_i"], data["sigma_i"], int(data["T2"])
+    try:
+        data = wire.read_response(res, "authenticate")
+        gamma_i, sigma_i, T2 = int(data["gamma_i"], 16), data["sigma_i"], int(data["T2"])
+    except (ValueError, KeyError, TypeError) as e:
+        # A truncated or malformed reply is an upstream failure, not ours
+        return upstream_failure(trace, "Server", e)
     T3 = int(time.time())
     if T3 - T2 > 60:
+        trace.finish(408)
         return JSONResponse({"error": "Server response too old"}, status_code=408)
 
     h_comb = hashlib.sha256((C_i + UID_i + ID_j + beta_i).encode()).hexdigest()
-    vt_loc = int(gamma_i, 16) ^ int(h_comb, 16)
+    vt_loc = gamma_i ^ int(h_comb, 16)
     SK_ij = hashlib.sha256((UID_i + ID_j + C_i + Loc_j + hex(vt_loc)[2:]).encode()).hexdigest()
     t_verify_sk = (time.perf_counter() - t6) * 1000
+    trace.record("verify_sk", t_verify_sk)
+    trace.finish(200)
 
     t_total = (time.perf_counter() - t_start) * 1000
 
     # Log detailed performance metrics
-    perf_logger.info(f"AUTHENTICATION | user={ID_i} | smartcard_load={t_smartcard_load:.3f}ms | credential_verify={t_credential_verify:.3f}ms | server_lookup={t_server_lookup:.3f}ms | msg_prep={t_msg_prep:.3f}ms | server_comm={t_server_comm:.3f}ms | verify_sk={t_verify_sk:.3f}ms | TOTAL={t_total:.3f}ms")
+    perf_logger.info(f"AUTHENTICATION | user={ID_i} | request_id={trace.trace_id} | card_cache={'hit' if unlocked else 'miss'} | smartcard_load={t_smartcard_load:.3f}ms | credential_verify={t_credential_verify:.3f}ms | server_lookup={t_server_lookup:.3f}ms | msg_prep={t_msg_prep:.3f}ms | server_comm={t_server_comm:.3f}ms | verify_sk={t_verify_sk:.3f}ms{server_timings} | TOTAL={t_total:.3f}ms")
 
     return JSONResponse({
         "message": "Mutual authentication successful",
@@ -266,12 +339,39 @@ async def authenticate_user(req: Request):
 
 
 @app.get("/", response_class=HTMLResponse)
-async def home():
-    html = get_cached_html()
-    if html:
-        return html
+async def home(req: Request):
+    if UI_ASSETS.index:
+        return asset_response(UI_ASSETS.index, req, immutable=False)
     return {"message": "User Middleware API is running 🚀"}
 
+@app.get("/assets/{name}")
+async def hashed_asset(name: str, req: Request):
+    asset = UI_ASSETS.by_name.get(name)
+    if asset is None:
+        return JSONResponse({"error": "Not found"}, status_code=404)
+    return asset_response(asset, req, immutable=True)
+
+# ====================== ADMIN PROFILING ======================
+def run_profile(req: Request, capture, **kwargs):
+    denied = admin.check_admin(req.headers)
+    if denied:
+        return JSONResponse({"error": denied[0]}, status_code=denied[1])
+    try:
+        return PlainTextResponse(capture(**kwargs))
+    except profiling.ProfilerBusy:
+        return JSONResponse({"error": "A profile is already running"}, status_code=409)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+# Plain (sync) handlers run in the threadpool, so the event loop keeps serving while sampling
+@app.get("/admin/profile/cpu")
+def admin_profile_cpu(req: Request, seconds: float = 10, interval_ms: float = profiling.DEFAULT_INTERVAL_MS):
+    return run_profile(req, profiling.sample_cpu, seconds=seconds, interval_ms=interval_ms)
+
+@app.get("/admin/profile/heap")
+def admin_profile_heap(req: Request, seconds: float = 5, top: int = 30):
+    return run_profile(req, profiling.snapshot_heap, seconds=seconds, top=top)
+
 @app.get("/health")
 def health():
     return {"message": "User Middleware API is running 🚀", "status": "healthy"}
@@ -0,0 +1,128 @@
+"""
+On-demand profiling for live services.
+
+Two captures are available, both run only while an admin request is in
+flight and cost nothing otherwise:
+- cpu: a sampling profiler that walks every thread's stack at a fixed
+  interval (sys._current_frames) for N seconds and returns collapsed
+  stacks ("frame;frame;frame count"), ready for flamegraph.pl/speedscope;
+- heap: a tracemalloc capture over N seconds, returning the top
+  allocation sites by size.
+
+Endpoints require the admin token (see admin.py). Only one capture runs at
+a time per process.
+"""
+
+import math
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from admin import admin_required
+
+MAX_PROFILE_SECONDS = 60
+DEFAULT_INTERVAL_MS = 5
+
+_capture_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _finite(value, name):
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError(f"{name} must be a finite number")
+    return value
+
+
+def _clamp_seconds(seconds):
+    return min(max(_finite(seconds, "seconds"), 0.1), MAX_PROFILE_SECONDS)
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def sample_cpu(seconds=10, interval_ms=DEFAULT_INTERVAL_MS):
+    """Sample all thread stacks for `seconds`; return collapsed-stack text."""
+    if not _capture_lock.acquire(blocking=False):
+        raise ProfilerBusy()
+    try:
+        seconds = _clamp_seconds(seconds)
+        interval = max(_finite(interval_ms, "interval_ms"), 1.0) / 1000
+        me = threading.get_ident()
+        names = {}
+        stacks = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names.update((t.ident, t.name) for t in threading.enumerate())
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(thread_id, str(thread_id)))
+                stacks[";".join(reversed(labels))] += 1
+            time.sleep(interval)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+    finally:
+        _capture_lock.release()
+
+
+def snapshot_heap(seconds=5, top=30):
+    """Trace allocations for `seconds` (or use an already-running tracemalloc); return top sites."""
+    if not _capture_lock.acquire(blocking=False):
+        raise ProfilerBusy()
+    try:
+        seconds = _clamp_seconds(seconds)
+        top = int(top)
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start()
+        try:
+            if started_here:
+                time.sleep(seconds)
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            # Never leave tracing (and its per-allocation cost) on after a failed capture
+            if started_here:
+                tracemalloc.stop()
+        stats = snapshot.statistics("lineno")
+        lines = [f"# traced current={current} B peak={peak} B sites={len(stats)}"]
+        lines.extend(f"{stat.size} B {stat.count} blocks {stat.traceback[0]}" for stat in stats[:top])
+        return "\n".join(lines) + "\n"
+    finally:
+        _capture_lock.release()
+
+
+def register_flask_routes(app):
+    """Add /admin/profile/cpu and /admin/profile/heap to a Flask app."""
+    from flask import request, Response, jsonify
+
+    def _run(capture, **kwargs):
+        try:
+            return Response(capture(**kwargs), mimetype="text/plain")
+        except ProfilerBusy:
+            return jsonify({"error": "A profile is already running"}), 409
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    @app.route('/admin/profile/cpu', methods=['GET'])
+    @admin_required
+    def admin_profile_cpu():
+        return _run(sample_cpu, seconds=request.args.get("seconds", 10),
+                    interval_ms=request.args.get("interval_ms", DEFAULT_INTERVAL_MS))
+
+    @app.route('/admin/profile/heap', methods=['GET'])
+    @admin_required
+    def admin_profile_heap():
+        return _run(snapshot_heap, seconds=request.args.get("seconds", 5), top=request.args.get("top", 30))
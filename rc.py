@@ -1,12 +1,25 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response, stream_with_context
 import hashlib
+import hmac
 import secrets
 import time
 import json
 import sqlite3
+import os
+import csv
+import io
+import threading
+import tracing
+import profiling
+import wire
+from rc_shards import UserShards
+from membership import MembershipIndex
+from admission import admission_controlled
+from admin import admin_required
 
 
 app = Flask(__name__)
+profiling.register_flask_routes(app)
 
 conn = sqlite3.connect('rc.db', check_same_thread=False)
 cursor = conn.cursor()
@@ -15,23 +28,126 @@ cursor.execute('''CREATE TABLE IF NOT EXISTS servers(
             SSK_j TEXT,
             Loc_j TEXT,
             Q_j TEXT)''')
-cursor.execute('''CREATE TABLE IF NOT EXISTS users(
-            UID_i TEXT PRIMARY KEY,
-            C_i TEXT)''')
+# Liveness columns, added in place for databases created before heartbeat tracking
+server_columns = {row[1] for row in cursor.execute("PRAGMA table_info(servers)")}
+if 'last_updated' not in server_columns:
+    cursor.execute("ALTER TABLE servers ADD COLUMN last_updated INTEGER")
+if 'alive' not in server_columns:
+    cursor.execute("ALTER TABLE servers ADD COLUMN alive INTEGER NOT NULL DEFAULT 1")
+# Change-feed version for hospital-server replicas, bumped whenever a row's replicated fields change
+if 'version' not in server_columns:
+    cursor.execute("ALTER TABLE servers ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("UPDATE servers SET version = rowid")
+# Grace period: every server gets one full staleness window from RC startup. Heartbeats sent while
+# the RC was down were never received, so pre-restart timestamps say nothing about liveness.
+_now = int(time.time())
+cursor.execute("UPDATE servers SET last_updated = ? WHERE last_updated IS NULL OR last_updated < ?", (_now, _now))
 conn.commit()
+
+# Group commit: batch user inserts arriving within this window (ms) into one transaction per shard. 0 = off.
+RC_GROUP_COMMIT_MS = float(os.environ.get("RC_GROUP_COMMIT_MS", "0"))
+# Users are partitioned by h(UID_i) across RC_USER_SHARDS databases (rc_shards.py)
+user_shards = UserShards(group_commit_ms=RC_GROUP_COMMIT_MS)
+
+# Registered IDs, kept in memory so duplicate checks never hit the database
+server_index = MembershipIndex(row[0] for row in cursor.execute("SELECT ID_j FROM servers"))
+user_index = MembershipIndex(user_shards.all_uids(), lookup=user_shards.exists)
 conn.close()
 
 r3 = secrets.token_hex(16)  # Random number
 K_rc = secrets.token_hex(32)  # RC's secret key
 
+# === SERVER LIVENESS ===
+HEARTBEAT_FLUSH_INTERVAL = float(os.environ.get("HEARTBEAT_FLUSH_INTERVAL", "1.0"))  # seconds between batched heartbeat writes
+SERVER_STALE_AFTER = int(os.environ.get("SERVER_STALE_AFTER", "180"))  # seconds without a heartbeat; 0 = never prune
+STALE_SWEEP_INTERVAL = 10
+
+NEXT_VERSION = "(SELECT COALESCE(MAX(version), 0) + 1 FROM servers)"
+
+_pending_heartbeats = {}
+_heartbeat_lock = threading.Lock()
+_list_sj_lock = threading.Lock()
+list_sj_snapshot = (0, [])  # (version, ["ID_j.SSK_j.Loc_j", ...]) for live servers only
+
+def refresh_list_sj(conn):
+    """Rebuild the live List_sj and bump its version if the set changed."""
+    global list_sj_snapshot
+    with _list_sj_lock:
+        rows = conn.execute("SELECT ID_j, SSK_j, Loc_j FROM servers WHERE alive = 1 ORDER BY rowid").fetchall()
+        List_sj = [f"{row[0]}.{row[1]}.{row[2]}" for row in rows]
+        if List_sj != list_sj_snapshot[1]:
+            list_sj_snapshot = (list_sj_snapshot[0] + 1, List_sj)
+
+def flush_heartbeats(conn):
+    """Write queued heartbeats in one transaction. Returns True if a stale server came back."""
+    with _heartbeat_lock:
+        batch = list(_pending_heartbeats.items())
+        _pending_heartbeats.clear()
+    if not batch:
+        return False
+    changes_before = conn.total_changes
+    conn.executemany(f"UPDATE servers SET alive = 1, version = {NEXT_VERSION} WHERE ID_j = ? AND alive = 0",
+                     [(ID_j,) for ID_j, _ in batch])
+    revived = conn.total_changes - changes_before
+    conn.executemany("UPDATE servers SET last_updated = ? WHERE ID_j = ?", [(T, ID_j) for ID_j, T in batch])
+    conn.commit()
+    return revived > 0
+
+def sweep_stale_servers(conn):
+    """Mark servers without a recent heartbeat as dead. Returns True if any were marked."""
+    cursor = conn.execute(f"UPDATE servers SET alive = 0, version = {NEXT_VERSION} WHERE alive = 1 AND last_updated < ?",
+                          (int(time.time()) - SERVER_STALE_AFTER,))
+    conn.commit()
+    return cursor.rowcount > 0
+
+def _liveness_loop():
+    conn = sqlite3.connect('rc.db')
+    last_sweep = 0
+    while True:
+        time.sleep(HEARTBEAT_FLUSH_INTERVAL)
+        try:
+            flush_heartbeats(conn)
+            if SERVER_STALE_AFTER > 0 and time.monotonic() - last_sweep >= STALE_SWEEP_INTERVAL:
+                sweep_stale_servers(conn)
+                last_sweep = time.monotonic()
+            # Rebuild from the database every time, not only when this process changed a row:
+            # another writer may have flipped alive flags. Unchanged lists keep their version.
+            refresh_list_sj(conn)
+        except sqlite3.Error as e:
+            # Heartbeats are resent periodically, so a dropped batch only delays liveness
+            print(f"Liveness update failed: {e}")
+
+_startup_conn = sqlite3.connect('rc.db')
+refresh_list_sj(_startup_conn)
+_startup_conn.close()
+
+def is_serving_process():
+    """False in the werkzeug reloader's watcher process (`python rc.py` runs with debug=True), which never serves."""
+    return __name__ != '__main__' or os.environ.get("WERKZEUG_RUN_MAIN") == "true"
+
+if is_serving_process():
+    threading.Thread(target=_liveness_loop, name="server-liveness", daemon=True).start()
+
+@app.after_request
+def add_timing_headers(response):
+    # Returns this service's phase timings to callers that sent an X-Request-ID
+    trace = g.get("trace")
+    if trace is not None:
+        response.headers.update(trace.timing_headers())
+    return response
+
 @app.route('/', methods=['GET'])
 
 def home():
     return jsonify({"message": "Welcome to the Registration Center"}), 200
 
 @app.route('/register_server', methods=['POST'])
+@admission_controlled('register_server')
 def register_server():
-    data = request.get_json()
+    try:
+        data = wire.read_request(request, "register_server")
+    except ValueError as e:
+        return jsonify({"error": f"Invalid request body: {e}"}), 400
     ID_j = data.get('ID_j')
     P_j = data.get('P_j')
     Q_j = data.get('Q_j')
@@ -40,79 +156,176 @@ def register_server():
     if not all([ID_j, P_j, Q_j, Loc_j]):
         return jsonify({"error": "Missing server parameters"}), 400
 
-    print(f"Registering server: {ID_j}, {P_j}, {Q_j}, {Loc_j}")
-
-    conn = sqlite3.connect('rc.db', check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute("SELECT ID_j FROM servers WHERE ID_j = ?", (ID_j,))
-    if cursor.fetchone():
-        conn.close()
+    trace = g.trace = tracing.start_trace("rc", "register_server", tracing.request_id_from(request.headers, request.remote_addr))
+    with trace.span("index_check"):
+        reserved = server_index.reserve(ID_j)
+    if not reserved:
+        trace.finish(409)
         return jsonify({"error": "Server ID already exists"}), 409
 
-    SRT_j = str(time.time())
-    SSK_j = hashlib.sha256((K_rc + P_j + SRT_j).encode()).hexdigest()
-    print(f"SSK_j: {SSK_j}")
-    
-    cursor.execute("INSERT INTO servers (ID_j, SSK_j, Loc_j, Q_j) VALUES (?, ?, ?, ?)",
-    (ID_j, SSK_j, Loc_j, Q_j))
-    conn.commit()
-    conn.close()
+    try:
+        with trace.span("ssk_derive"):
+            SRT_j = str(time.time())
+            SSK_j = hashlib.sha256((K_rc + P_j + SRT_j).encode()).hexdigest()
+
+        with trace.span("db_write"):
+            conn = sqlite3.connect('rc.db', check_same_thread=False)
+            conn.execute(f"INSERT INTO servers (ID_j, SSK_j, Loc_j, Q_j, last_updated, alive, version) VALUES (?, ?, ?, ?, ?, 1, {NEXT_VERSION})",
+            (ID_j, SSK_j, Loc_j, Q_j, int(time.time())))
+            conn.commit()
+        server_index.commit(ID_j)
+        with trace.span("list_sj_refresh"):
+            refresh_list_sj(conn)
+        conn.close()
+    finally:
+        server_index.release(ID_j)
 
-    print(f"Server registered: {ID_j}")
-    return jsonify({"SSK_j": SSK_j}), 201
+    trace.finish(201)
+    return wire.respond(request, "register_server", {"SSK_j": SSK_j}, 201)
 
 @app.route('/register_user', methods=['POST'])
-@app.route('/register_user', methods=['POST'])
+@admission_controlled('register_user')
 def register_user():
-    data = request.get_json()
+    try:
+        data = wire.read_request(request, "register_user")
+    except ValueError as e:
+        return jsonify({"error": f"Invalid request body: {e}"}), 400
     UID_i = data.get('UID_i')
     A_i = data.get('A_i')
 
     if not UID_i or not A_i:
         return jsonify({"error": "Missing user parameters"}), 400
 
+    # Live servers only, from the in-memory snapshot. With none live (e.g. every server pruned),
+    # refuse before storing anything: the card's Z_i cannot encode an empty List_sj.
+    List_sj_version, List_sj = list_sj_snapshot
+    if not List_sj:
+        response = jsonify({"error": "No live servers registered; try again later"})
+        response.headers["Retry-After"] = str(STALE_SWEEP_INTERVAL)
+        return response, 503
+
+    trace = g.trace = tracing.start_trace("rc", "register_user", tracing.request_id_from(request.headers, request.remote_addr))
+    with trace.span("index_check"):
+        reserved = user_index.reserve(UID_i)
+    if not reserved:
+        trace.finish(409)
+        return jsonify({"error": "User ID already exists"}), 409
+
+    status = 500
     try:
-        conn = sqlite3.connect('rc.db', check_same_thread=False)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT UID_i FROM users WHERE UID_i = ?", (UID_i,))
-        if cursor.fetchone():
-            return jsonify({"error": "User ID already exists"}), 409
-
-        # Calculate USK_i
-        USK_i = hashlib.sha256((K_rc + UID_i + r3).encode()).hexdigest()
+        with trace.span("credential_derive"):
+            # Calculate USK_i
+            USK_i = hashlib.sha256((K_rc + UID_i + r3).encode()).hexdigest()
 
-        # Calculate C_i
-        C_i = hex(int(hashlib.sha256((K_rc + r3 + A_i).encode()).hexdigest(), 16) ^ 
-                  int(USK_i, 16) ^ 
-                  int(hashlib.sha256((UID_i + A_i).encode()).hexdigest(), 16))[2:].zfill(64)
+            # Calculate C_i
+            C_i = hex(int(hashlib.sha256((K_rc + r3 + A_i).encode()).hexdigest(), 16) ^ 
+                      int(USK_i, 16) ^ 
+                      int(hashlib.sha256((UID_i + A_i).encode()).hexdigest(), 16))[2:].zfill(64)
 
-        # Calculate D_i
-        D_i = hex(int(A_i, 16) ^ int(USK_i, 16))[2:].zfill(64)
+            # Calculate D_i
+            D_i = hex(int(A_i, 16) ^ int(USK_i, 16))[2:].zfill(64)
 
         # Store in database
-        cursor.execute("INSERT INTO users (UID_i, C_i) VALUES (?, ?)", (UID_i, C_i))
-        conn.commit()
+        with trace.span("db_write"):
+            user_shards.insert(UID_i, C_i)
+        user_index.commit(UID_i)
 
-        # Get List_sj
-        cursor.execute("SELECT ID_j, SSK_j, Loc_j FROM servers")
-        rows = cursor.fetchall()
-        List_sj = [f"{row[0]}.{row[1]}.{row[2]}" for row in rows]
-        print(f"Fetched List_sj from DB: {List_sj}")
+        SC_i = {"C_i": C_i, "D_i": D_i, "List_sj": List_sj, "List_sj_version": List_sj_version}
+        status = 201
+        return wire.respond(request, "register_user", SC_i, 201)
 
-        SC_i = {"C_i": C_i, "D_i": D_i, "List_sj": List_sj}
-        return jsonify(SC_i), 201
+    except sqlite3.IntegrityError:
+        status = 409
+        return jsonify({"error": "User ID already exists"}), 409
 
     except ValueError as ve:
+        status = 400
         return jsonify({"error": f"Invalid A_i format: {ve}"}), 400
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
     finally:
-        conn.close()
+        user_index.release(UID_i)
+        trace.finish(status)
+
+
+
+# === BULK SERVER DIRECTORY ===
+SERVER_MANIFEST_FIELDS = ("ID_j", "P_j", "Q_j", "Loc_j")
+EXPORT_BATCH_SIZE = 1000
+
+def parse_server_manifest(body, content_type):
+    """Parse a CSV (with header) or JSON-lines server manifest into a list of dicts."""
+    text = body.decode("utf-8")
+    if "csv" in (content_type or ""):
+        return [dict(row) for row in csv.DictReader(io.StringIO(text))]
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+@app.route('/register_servers_bulk', methods=['POST'])
+@admin_required
+def register_servers_bulk():
+    try:
+        manifest = parse_server_manifest(request.get_data(), request.content_type)
+    except (ValueError, csv.Error) as e:
+        return jsonify({"error": f"Invalid manifest: {e}"}), 400
+
+    invalid = [n for n, row in enumerate(manifest, 1)
+               if not isinstance(row, dict)
+               or not all(isinstance(row.get(f), str) and row[f] for f in SERVER_MANIFEST_FIELDS)]
+    if invalid:
+        return jsonify({"error": "Missing or non-string server parameters", "rows": invalid[:100]}), 400
+
+    reserved, duplicates = [], []
+    for row in manifest:
+        (reserved if server_index.reserve(row["ID_j"]) else duplicates).append(row["ID_j"])
+    try:
+        if duplicates:
+            return jsonify({"error": "Server ID already exists", "ID_j": duplicates[:100]}), 409
 
+        rows = []
+        for row in manifest:
+            SRT_j = str(time.time())
+            SSK_j = hashlib.sha256((K_rc + row["P_j"] + SRT_j).encode()).hexdigest()
+            rows.append((row["ID_j"], SSK_j, row["Loc_j"], row["Q_j"], int(time.time())))
 
+        # One transaction and one List_sj rebuild for the whole manifest
+        conn = sqlite3.connect('rc.db', check_same_thread=False)
+        try:
+            with conn:
+                conn.executemany(f"INSERT INTO servers (ID_j, SSK_j, Loc_j, Q_j, last_updated, alive, version) VALUES (?, ?, ?, ?, ?, 1, {NEXT_VERSION})", rows)
+            for ID_j in reserved:
+                server_index.commit(ID_j)
+            refresh_list_sj(conn)
+        finally:
+            conn.close()
+    finally:
+        for ID_j in reserved:
+            server_index.release(ID_j)
+
+    return jsonify({
+        "registered": len(rows),
+        "List_sj_version": list_sj_snapshot[0],
+        "servers": [{"ID_j": row[0], "SSK_j": row[1]} for row in rows],
+    }), 201
+
+@app.route('/export_servers', methods=['GET'])
+@admin_required
+def export_servers():
+    def generate():
+        conn = sqlite3.connect('rc.db')
+        try:
+            cursor = conn.execute("SELECT ID_j, SSK_j, Loc_j, Q_j, last_updated, alive, version FROM servers ORDER BY rowid")
+            columns = [d[0] for d in cursor.description]
+            while True:
+                batch = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                if not batch:
+                    break
+                yield "".join(json.dumps(dict(zip(columns, row))) + "\n" for row in batch)
+        finally:
+            conn.close()
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
 @app.route('/update_server_db', methods=['POST'])
 def rc_server_db_update():
@@ -126,24 +339,73 @@ def rc_server_db_update():
     if abs(int(time.time()) - T) > 60:
         return jsonify({"error": "Timestamp too old. Possible replay attack."}), 403
 
-    conn = sqlite3.connect('rc.db', check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM servers WHERE ID_j = ?", (ID_j,))
-    server = cursor.fetchone()
-
-    if not server:
-        conn.close()
+    if ID_j not in server_index:
         return jsonify({"error": "Server not found"}), 404
 
-    # Optional: add new column "last_updated" and update it here
-    # cursor.execute("UPDATE servers SET last_updated = ? WHERE ID_j = ?", (T, ID_j))
-
-    conn.commit()
-    conn.close()
+    # Written by the liveness thread in the next batch
+    with _heartbeat_lock:
+        _pending_heartbeats[ID_j] = max(T, _pending_heartbeats.get(ID_j, 0))
 
     return jsonify({"message": f"Server {ID_j} verified and updated."}), 200
 
+# === SERVER REPLICA FEED ===
+# Only what the RC changes after registration. SSK_j and Q_j never leave the RC through the feed:
+# the server already holds them, and the feed must not hand them to anyone who replays a poll.
+REPLICA_FIELDS = ("ID_j", "Loc_j", "alive", "version")
+REPLICA_PROOF_WINDOW = 60  # seconds, as for heartbeat timestamps
+used_replica_proofs = {}  # proof -> when its T leaves the freshness window
+used_replica_proofs_lock = threading.Lock()
+
+def replica_proof(SSK_j, ID_j, T, since, nonce):
+    return hmac.new(SSK_j.encode(), f"{ID_j}|{T}|{since}|{nonce}".encode(), hashlib.sha256).hexdigest()
+
+def claim_replica_proof(proof, T):
+    """Accept each proof once. Expired entries are dropped: their T alone gets them rejected."""
+    now = time.time()
+    with used_replica_proofs_lock:
+        for used in [p for p, expires in used_replica_proofs.items() if expires < now]:
+            del used_replica_proofs[used]
+        if proof in used_replica_proofs:
+            return False
+        used_replica_proofs[proof] = T + REPLICA_PROOF_WINDOW
+        return True
+
+@app.route('/replica/servers', methods=['POST'])
+def replica_servers():
+    """Change feed for a hospital server's local replica: its own row, if changed since `since`."""
+    data = request.get_json(silent=True) or {}
+    ID_j = data.get("ID_j")
+    proof = data.get("proof")
+    nonce = data.get("nonce")
+    try:
+        T = int(data.get("T", 0))
+        since = int(data.get("since", 0))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid T or since"}), 400
+
+    if not ID_j or not T or not proof or not nonce:
+        return jsonify({"error": "Missing ID_j, T, nonce or proof"}), 400
+
+    if abs(int(time.time()) - T) > REPLICA_PROOF_WINDOW:
+        return jsonify({"error": "Timestamp too old. Possible replay attack."}), 403
+
+    conn = sqlite3.connect('rc.db')
+    try:
+        row = conn.execute(f"SELECT SSK_j, {', '.join(REPLICA_FIELDS)} FROM servers WHERE ID_j = ?", (ID_j,)).fetchone()
+    finally:
+        conn.close()
+    # Same answer for unknown servers and bad proofs
+    if row is None or not hmac.compare_digest(replica_proof(row[0], ID_j, T, since, nonce), str(proof)):
+        return jsonify({"error": "Replica authentication failed"}), 403
+    if not claim_replica_proof(proof, T):
+        return jsonify({"error": "Replica proof already used. Possible replay attack."}), 403
+
+    record = dict(zip(REPLICA_FIELDS, row[1:]))
+    return jsonify({
+        "version": record["version"],
+        "servers": [record] if record["version"] > since else [],
+    }), 200
 
 
 if __name__ == '__main__':
-    app.run(port=5000, debug=True)
\ No newline at end of file
+    app.run(port=5000, debug=True, threaded=True)
\ No newline at end of file
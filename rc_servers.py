@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Bulk server directory tool for the RC.
+
+    # build a manifest (P_j/Q_j computed the way server1.py does)
+    python rc_servers.py generate 500 --out manifest.csv --password admin1234 --location Goa
+
+    # register every server in one request; SSK_j values go to the output file
+    python rc_servers.py import manifest.csv --out ssk.jsonl
+
+    # seed each hospital server's replica from that file (server1.py)
+    SERVER_ID=hospital7 REPLICA_BOOTSTRAP_FILE=ssk.jsonl python server1.py
+
+    # stream the whole directory out as JSON lines
+    python rc_servers.py export servers.jsonl
+
+    # keep imported servers in List_sj (the RC drops servers that stop heartbeating)
+    python rc_servers.py heartbeat manifest.csv --interval 60
+
+Import and export need the RC's admin token (ADMIN_TOKEN or --token).
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import secrets
+import sys
+import time
+
+import requests
+
+from admin import ADMIN_TOKEN, ADMIN_TOKEN_HEADER
+
+RC_URL = os.environ.get("RC_URL", "http://127.0.0.1:5000")
+REQUEST_TIMEOUT = float(os.environ.get("RC_SERVERS_TIMEOUT", "300"))  # seconds; bulk imports of large manifests are slow
+MANIFEST_FIELDS = ("ID_j", "P_j", "Q_j", "Loc_j")
+
+
+def server_credentials(ID_j, PW_j):
+    """P_j and Q_j for one server, as calculated by server1.py at registration."""
+    r_S = secrets.token_hex(16)
+    P_j = hashlib.sha256((ID_j + r_S + PW_j).encode()).hexdigest()
+    h1 = hashlib.sha256((ID_j + PW_j).encode()).hexdigest()
+    Q_j = hex(int(h1, 16) ^ int(P_j, 16))[2:].zfill(64)
+    return P_j, Q_j
+
+
+def generate(args):
+    with open(args.out, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(MANIFEST_FIELDS)
+        for i in range(1, args.count + 1):
+            ID_j = f"{args.prefix}{i}"
+            writer.writerow((ID_j, *server_credentials(ID_j, args.password), args.location))
+    print(f"Wrote {args.count} servers to {args.out}")
+
+
+def import_manifest(args):
+    content_type = "text/csv" if args.manifest.endswith(".csv") else "application/x-ndjson"
+    with open(args.manifest, "rb") as f:
+        response = requests.post(f"{args.rc}/register_servers_bulk", data=f,
+                                 headers={"Content-Type": content_type, ADMIN_TOKEN_HEADER: args.token},
+                                 timeout=args.timeout)
+    if response.status_code != 201:
+        sys.exit(f"Import failed ({response.status_code}): {response.text}")
+
+    result = response.json()
+    out = open(args.out, "w") if args.out else sys.stdout
+    try:
+        for server in result["servers"]:
+            out.write(json.dumps(server) + "\n")
+    finally:
+        if args.out:
+            out.close()
+    print(f"Registered {result['registered']} servers (List_sj version {result['List_sj_version']})", file=sys.stderr)
+
+
+def export_directory(args):
+    count = 0
+    with requests.get(f"{args.rc}/export_servers", headers={ADMIN_TOKEN_HEADER: args.token},
+                      stream=True, timeout=args.timeout) as response:
+        if response.status_code != 200:
+            sys.exit(f"Export failed ({response.status_code}): {response.text}")
+        with open(args.out, "wb") as f:
+            for line in response.iter_lines():
+                if line:
+                    f.write(line + b"\n")
+                    count += 1
+    print(f"Exported {count} servers to {args.out}")
+
+
+def read_manifest_ids(path):
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            return [row["ID_j"] for row in csv.DictReader(f)]
+        return [json.loads(line)["ID_j"] for line in f if line.strip()]
+
+
+def heartbeat(args):
+    """Send /update_server_db for every server in a manifest, every --interval seconds."""
+    ids = read_manifest_ids(args.manifest)
+    print(f"Heartbeating {len(ids)} servers every {args.interval}s (Ctrl-C to stop)", file=sys.stderr)
+    with requests.Session() as session:
+        while True:
+            failed = 0
+            for ID_j in ids:
+                try:
+                    response = session.post(f"{args.rc}/update_server_db", timeout=args.timeout,
+                                            json={"ID_j": ID_j, "T": str(int(time.time()))})
+                    failed += response.status_code != 200
+                except requests.exceptions.RequestException:
+                    failed += 1
+            if failed:
+                print(f"{failed}/{len(ids)} heartbeats failed", file=sys.stderr)
+            if args.once:
+                return
+            time.sleep(args.interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk RC server directory import/export")
+    parser.add_argument("--rc", default=RC_URL, help="RC base URL")
+    parser.add_argument("--token", default=ADMIN_TOKEN, help="Admin token (default: $ADMIN_TOKEN)")
+    parser.add_argument("--timeout", type=float, default=REQUEST_TIMEOUT, help="Seconds per request to the RC")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate", help="Write a manifest of N servers")
+    gen.add_argument("count", type=int)
+    gen.add_argument("--out", default="manifest.csv")
+    gen.add_argument("--prefix", default="hospital")
+    gen.add_argument("--password", default="admin1234")
+    gen.add_argument("--location", default="Goa")
+    gen.set_defaults(func=generate)
+
+    imp = sub.add_parser("import", help="Register every server in a .csv or .jsonl manifest")
+    imp.add_argument("manifest")
+    imp.add_argument("--out", help="Write ID_j/SSK_j lines here instead of stdout")
+    imp.set_defaults(func=import_manifest)
+
+    exp = sub.add_parser("export", help="Stream the server directory to a JSON-lines file")
+    exp.add_argument("out")
+    exp.set_defaults(func=export_directory)
+
+    hb = sub.add_parser("heartbeat", help="Keep every server in a manifest alive in List_sj")
+    hb.add_argument("manifest")
+    hb.add_argument("--interval", type=float, default=60, help="Seconds between rounds (below SERVER_STALE_AFTER)")
+    hb.add_argument("--once", action="store_true", help="Send one round and exit")
+    hb.set_defaults(func=heartbeat)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
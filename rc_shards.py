@@ -0,0 +1,196 @@
+"""
+Hash-partitioned storage for the RC's users table.
+
+A user lives in shard `h(UID_i) mod N`, where N is RC_USER_SHARDS. Each
+shard is its own SQLite file, and so has its own writer lock (and its own
+group-commit writer when RC_GROUP_COMMIT_MS is set). With N = 1 the single
+shard is the `users` table in rc.db, as before sharding.
+
+Shard files carry the shard count in their name (rc_users_<N>_<i>.db), so
+changing N with the offline rebalance tool writes a new set of files next
+to the old one:
+
+    # stop the RC first
+    python rc_shards.py rebalance --from 1 --to 8
+    RC_USER_SHARDS=8 python rc.py
+
+The active shard count is recorded in rc.db (rc_meta) by the rebalance
+tool, and the RC refuses to start with any other RC_USER_SHARDS.
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+
+from group_commit import GroupCommitWriter
+
+RC_DB = 'rc.db'
+RC_USER_SHARDS = int(os.environ.get("RC_USER_SHARDS", "1"))
+REBALANCE_BATCH_SIZE = 10000
+SHARD_COUNT_KEY = "user_shards"
+
+
+def shard_path(shard, shard_count):
+    if shard_count == 1:
+        return RC_DB
+    return f"rc_users_{shard_count}_{shard}.db"
+
+
+def shard_for(UID_i, shard_count):
+    # Hash again rather than trusting UID_i's own distribution: it is client-supplied
+    return int.from_bytes(hashlib.sha256(UID_i.encode()).digest()[:8], "big") % shard_count
+
+
+def init_shard(path):
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE IF NOT EXISTS users(
+            UID_i TEXT PRIMARY KEY,
+            C_i TEXT)''')
+    conn.commit()
+    conn.close()
+
+
+def _meta_conn():
+    conn = sqlite3.connect(RC_DB)
+    conn.execute("CREATE TABLE IF NOT EXISTS rc_meta(key TEXT PRIMARY KEY, value TEXT)")
+    return conn
+
+
+def recorded_shard_count():
+    """The shard count the users were last written with, or None if never recorded."""
+    conn = _meta_conn()
+    try:
+        row = conn.execute("SELECT value FROM rc_meta WHERE key = ?", (SHARD_COUNT_KEY,)).fetchone()
+        return int(row[0]) if row else None
+    finally:
+        conn.close()
+
+
+def record_shard_count(shard_count):
+    conn = _meta_conn()
+    try:
+        conn.execute("INSERT OR REPLACE INTO rc_meta (key, value) VALUES (?, ?)", (SHARD_COUNT_KEY, str(shard_count)))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class UserShards:
+    def __init__(self, shard_count=RC_USER_SHARDS, group_commit_ms=0):
+        if shard_count < 1:
+            raise ValueError("RC_USER_SHARDS must be at least 1")
+        recorded = recorded_shard_count()
+        if recorded is None:
+            # First start (or first since the count was tracked): adopt the configured count
+            record_shard_count(shard_count)
+        elif recorded != shard_count:
+            raise RuntimeError(f"RC_USER_SHARDS={shard_count} but users are stored in {recorded} shard(s); "
+                               f"run 'python rc_shards.py rebalance --from {recorded} --to {shard_count}' first")
+        self.shard_count = shard_count
+        self.paths = [shard_path(i, shard_count) for i in range(shard_count)]
+        for path in self.paths:
+            init_shard(path)
+        self.writers = [GroupCommitWriter(path, group_commit_ms) for path in self.paths] if group_commit_ms > 0 else None
+
+    def shard_of(self, UID_i):
+        return shard_for(UID_i, self.shard_count)
+
+    def insert(self, UID_i, C_i):
+        shard = self.shard_of(UID_i)
+        if self.writers:
+            # Returns only once the batch holding this row has committed
+            self.writers[shard].submit("INSERT INTO users (UID_i, C_i) VALUES (?, ?)", (UID_i, C_i))
+            return
+        conn = sqlite3.connect(self.paths[shard])
+        try:
+            conn.execute("INSERT INTO users (UID_i, C_i) VALUES (?, ?)", (UID_i, C_i))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def exists(self, UID_i):
+        conn = sqlite3.connect(self.paths[self.shard_of(UID_i)])
+        try:
+            return conn.execute("SELECT 1 FROM users WHERE UID_i = ?", (UID_i,)).fetchone() is not None
+        finally:
+            conn.close()
+
+    def all_uids(self):
+        for path in self.paths:
+            conn = sqlite3.connect(path)
+            try:
+                for row in conn.execute("SELECT UID_i FROM users"):
+                    yield row[0]
+            finally:
+                conn.close()
+
+
+def rebalance(old_count, new_count, force=False):
+    """Copy every user from the old shard set into a new one. The RC must be stopped."""
+    if old_count == new_count:
+        raise ValueError("Old and new shard counts are the same")
+    recorded = recorded_shard_count()
+    if recorded is not None and recorded != old_count:
+        raise ValueError(f"Users are stored in {recorded} shard(s), not {old_count}")
+    old_paths = [shard_path(i, old_count) for i in range(old_count)]
+    new_paths = [shard_path(i, new_count) for i in range(new_count)]
+    for path in old_paths:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Missing source shard {path}")
+
+    targets = []
+    for path in new_paths:
+        init_shard(path)
+        conn = sqlite3.connect(path)
+        if conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] and not force:
+            conn.close()
+            raise FileExistsError(f"Target shard {path} is not empty (use --force to merge into it)")
+        targets.append(conn)
+
+    copied = 0
+    for path in old_paths:
+        source = sqlite3.connect(path)
+        cursor = source.execute("SELECT UID_i, C_i FROM users")
+        while True:
+            rows = cursor.fetchmany(REBALANCE_BATCH_SIZE)
+            if not rows:
+                break
+            buckets = [[] for _ in range(new_count)]
+            for row in rows:
+                buckets[shard_for(row[0], new_count)].append(row)
+            for conn, bucket in zip(targets, buckets):
+                if bucket:
+                    conn.executemany("INSERT OR REPLACE INTO users (UID_i, C_i) VALUES (?, ?)", bucket)
+            copied += len(rows)
+        source.close()
+
+    counts = []
+    for conn in targets:
+        conn.commit()
+        counts.append(conn.execute("SELECT COUNT(*) FROM users").fetchone()[0])
+        conn.close()
+    # Only once every target has committed: a failed run leaves the RC on the old set
+    record_shard_count(new_count)
+    return copied, dict(zip(new_paths, counts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RC user shard maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    reb = sub.add_parser("rebalance", help="Copy users into a new shard count (run with the RC stopped)")
+    reb.add_argument("--from", dest="old_count", type=int, required=True)
+    reb.add_argument("--to", dest="new_count", type=int, required=True)
+    reb.add_argument("--force", action="store_true", help="Merge into non-empty target shards")
+    args = parser.parse_args()
+
+    copied, counts = rebalance(args.old_count, args.new_count, args.force)
+    print(f"Copied {copied} users from {args.old_count} to {args.new_count} shard(s):")
+    for path, count in counts.items():
+        print(f"  {path}: {count}")
+    print(f"Restart the RC with RC_USER_SHARDS={args.new_count}. Old shard files were left in place "
+          f"but are no longer updated; to roll back, rebalance --from {args.new_count} --to {args.old_count} --force.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,34 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 import hashlib
+import hmac
 import secrets
 import time
 import requests
 import json
 import os
 import sqlite3
+import threading
+import tracing
+import profiling
+import wire
+from admission import admission_controlled
 app = Flask(__name__)
+profiling.register_flask_routes(app)
 
 
 def init_server_db():
-    conn = sqlite3.connect('server.db')
+    conn = sqlite3.connect(SERVER_DB)
     cursor = conn.cursor()
     cursor.execute('''CREATE TABLE IF NOT EXISTS servers(
                 ID_j TEXT PRIMARY KEY,
                 SSK_j TEXT,
                 Loc_j TEXT,
                 Q_j TEXT)''')
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(servers)")}
+    if 'alive' not in columns:
+        cursor.execute("ALTER TABLE servers ADD COLUMN alive INTEGER NOT NULL DEFAULT 1")
+    if 'version' not in columns:
+        cursor.execute("ALTER TABLE servers ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
     conn.commit()
     conn.close()
 
@@ -26,7 +38,18 @@ def init_server_db():
 RC_URL = os.environ.get("RC_URL", "http://localhost:5000")
 ID_j = os.environ.get("SERVER_ID", "hospital2")
 PW_j = os.environ.get("SERVER_PASSWORD", "admin1234")
+WIRE_FORMAT = wire.check_format(os.environ.get("WIRE_FORMAT", "json"))  # json | binary | msgpack, for calls to the RC
 Loc_j = os.environ.get("SERVER_LOCATION", "Goa")
+HEARTBEAT_INTERVAL = int(os.environ.get("HEARTBEAT_INTERVAL", "60"))  # seconds; 0 = no automatic heartbeats
+UPSTREAM_TIMEOUT = float(os.environ.get("UPSTREAM_TIMEOUT", "5"))  # seconds, per call to the RC
+SERVER_DB = os.environ.get("SERVER_DB", "server.db")  # this server's local replica of its RC record
+REPLICA_SYNC_INTERVAL = int(os.environ.get("REPLICA_SYNC_INTERVAL", "30"))  # seconds; 0 = no background sync
+# Answer 503 while the RC has this server marked stale. Off by default: a user whose card already
+# lists this server can still log in, and a heartbeat gap should not lock them out.
+REPLICA_ENFORCE_ALIVE = os.environ.get("REPLICA_ENFORCE_ALIVE", "0") == "1"
+# ID_j/SSK_j lines written by `rc_servers.py import --out`, for servers registered in bulk
+REPLICA_BOOTSTRAP_FILE = os.environ.get("REPLICA_BOOTSTRAP_FILE")
+LEGACY_RC_DB = 'rc.db'  # read once, to seed the replica on hosts that still share the RC's database
 r_S = secrets.token_hex(16)
 SSK_j = None
 
@@ -42,6 +65,102 @@ def xor_hex_strings(hex_str1, hex_str2):
     int_val = int(hex_str1, 16) ^ int(hex_str2, 16)
     return hex(int_val)[2:].zfill(64)
 
+# === LOCAL REPLICA ===
+REPLICA_FIELDS = ("ID_j", "SSK_j", "Loc_j", "Q_j", "alive", "version")
+FEED_FIELDS = ("Loc_j", "alive", "version")  # all the RC's change feed sends; SSK_j and Q_j stay local
+replica = None  # this server's row as a dict; replaced whole, never mutated
+
+def load_replica():
+    global replica, SSK_j
+    conn = sqlite3.connect(SERVER_DB)
+    try:
+        row = conn.execute(f"SELECT {', '.join(REPLICA_FIELDS)} FROM servers WHERE ID_j = ?", (ID_j,)).fetchone()
+    finally:
+        conn.close()
+    if row:
+        replica = dict(zip(REPLICA_FIELDS, row))
+        SSK_j = replica["SSK_j"]
+    return replica
+
+def store_replica(record):
+    conn = sqlite3.connect(SERVER_DB)
+    try:
+        conn.execute(f"INSERT OR REPLACE INTO servers ({', '.join(REPLICA_FIELDS)}) VALUES (?, ?, ?, ?, ?, ?)",
+                     tuple(record.get(field) for field in REPLICA_FIELDS))
+        conn.commit()
+    finally:
+        conn.close()
+    load_replica()
+
+def seed_from_legacy_rc_db():
+    """One-time migration: copy this server's row out of a co-located rc.db."""
+    if not os.path.exists(LEGACY_RC_DB):
+        return False
+    conn = sqlite3.connect(LEGACY_RC_DB)
+    try:
+        row = conn.execute("SELECT ID_j, SSK_j, Loc_j, Q_j FROM servers WHERE ID_j = ?", (ID_j,)).fetchone()
+    except sqlite3.Error:
+        row = None
+    finally:
+        conn.close()
+    if row:
+        store_replica({**dict(zip(REPLICA_FIELDS, row)), "alive": 1, "version": 0})
+    return row is not None
+
+def seed_from_bootstrap_file(path):
+    """Seed from bulk-import output. Loc_j is this server's own until the first sync brings the RC's."""
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            server = json.loads(line)
+            if server.get("ID_j") == ID_j and server.get("SSK_j"):
+                # Q_j is only needed by the RC; version 0 makes the first sync return the whole RC row
+                store_replica({"ID_j": ID_j, "SSK_j": server["SSK_j"], "Loc_j": Loc_j, "Q_j": None, "alive": 1, "version": 0})
+                return True
+    return False
+
+def sync_replica():
+    """Pull this server's row from the RC change feed. Returns True if the replica changed."""
+    if replica is None:
+        return False
+    T = str(int(time.time()))
+    since = replica["version"]
+    nonce = secrets.token_hex(16)
+    proof = hmac.new(replica["SSK_j"].encode(), f"{ID_j}|{T}|{since}|{nonce}".encode(), hashlib.sha256).hexdigest()
+    response = requests.post(f"{RC_URL}/replica/servers", timeout=UPSTREAM_TIMEOUT,
+                             json={"ID_j": ID_j, "T": T, "since": since, "nonce": nonce, "proof": proof})
+    response.raise_for_status()
+    changes = [record for record in response.json().get("servers", []) if record.get("ID_j") == ID_j]
+    for record in changes:
+        store_replica({**replica, **{field: record[field] for field in FEED_FIELDS}})
+    return bool(changes)
+
+def _replica_loop():
+    while True:
+        try:
+            sync_replica()
+        except (requests.exceptions.RequestException, ValueError, sqlite3.Error) as e:
+            # Authentication keeps using the last synced copy
+            print(f"Replica sync failed: {e}")
+        # While marked inactive, poll quickly so a heartbeat revival restores logins promptly
+        time.sleep(REPLICA_SYNC_INTERVAL if replica is None or replica["alive"] else min(REPLICA_SYNC_INTERVAL, 5))
+
+init_server_db()
+if load_replica() is None:
+    if REPLICA_BOOTSTRAP_FILE and not seed_from_bootstrap_file(REPLICA_BOOTSTRAP_FILE):
+        print(f"{ID_j} not found in {REPLICA_BOOTSTRAP_FILE}")
+    if replica is None:
+        seed_from_legacy_rc_db()
+
+@app.after_request
+def add_timing_headers(response):
+    # Returns this service's phase timings to callers that sent an X-Request-ID
+    trace = g.get("trace")
+    if trace is not None:
+        response.headers.update(trace.timing_headers())
+    return response
+
 @app.route('/', methods=['GET'])
 def home():
     return jsonify({"message": "Welcome to the server ",
@@ -61,24 +180,30 @@ def register_server():
         "Loc_j": Loc_j
     }
     try:
-        response = requests.post(f"{RC_URL}/register_server", json=data)
+        response = requests.post(f"{RC_URL}/register_server", timeout=UPSTREAM_TIMEOUT, **wire.request_kwargs(WIRE_FORMAT, "register_server", data))
         response.raise_for_status()
-        result = response.json()
-        global SSK_j
-        SSK_j = result.get('SSK_j')
-        if SSK_j:
-            print(f"Server registered. SSK_j:{SSK_j}")
+        result = wire.read_response(response, "register_server")
+        if result.get('SSK_j'):
+            store_replica({"ID_j": ID_j, "SSK_j": result['SSK_j'], "Loc_j": Loc_j, "Q_j": Q_j, "alive": 1, "version": 0})
+            print(f"Server registered: {ID_j}")
             return jsonify({"message": "Server registered"}), 200
         else:
             print("Server registration failed")
             return jsonify({"error": "Server registration failed"}), 500
+    except requests.exceptions.Timeout as e:
+        print(f"Timed out registering with RC: {e}")
+        return jsonify({"error": f"Registration timed out: {e}"}), 504
     except requests.exceptions.RequestException as e:
         print(f"Error registering with RC: {e}")
         return jsonify({"error": f"Registration failed: {e}"}), 500
 
 @app.route('/authenticate', methods=['POST'])
+@admission_controlled('authenticate')
 def authenticate_user():
-    data = request.get_json()
+    try:
+        data = wire.read_request(request, "authenticate")
+    except ValueError as e:
+        return jsonify({"error": f"Invalid request body: {e}"}), 400
     alpha_i = data.get("alpha_i")
     beta_i = data.get("beta_i")
     T1 = data.get("T1")
@@ -89,42 +214,66 @@ def authenticate_user():
     if ID_j_received != ID_j:
         return jsonify({"error": "Invalid Server ID"}), 403
     
+    trace = g.trace = tracing.start_trace("server", "authenticate", tracing.request_id_from(request.headers, request.remote_addr))
     T2 = str(int(time.time()))
     # Step 1: Recompute UID_i from alpha
-    cursor = sqlite3.connect('rc.db').cursor()
-    SSK_j = cursor.execute("SELECT SSK_j FROM servers WHERE ID_j = ?", (ID_j,)).fetchone()
-    SSK_j = SSK_j[0] if SSK_j else None
-    print(SSK_j)
-    h_val = hashlib.sha256((ID_j + SSK_j + T1).encode()).hexdigest()
-    UID_i_recovered = hex(int(alpha_i, 16) ^ int(h_val, 16))[2:].zfill(64)
-
-    beta_check = hashlib.sha256((UID_i_recovered + SSK_j + C_i + T1).encode()).hexdigest()
+    with trace.span("ssk_lookup"):
+        record = replica
+    if record is None:
+        trace.finish(503)
+        return jsonify({"error": "Server is not registered with the RC"}), 503
+    if REPLICA_ENFORCE_ALIVE and not record["alive"]:
+        # The RC has dropped this server from List_sj; it comes back on the next heartbeat + sync
+        trace.finish(503)
+        return jsonify({"error": "Server is marked inactive by the RC"}), 503
+    # Loc_j as the RC published it in List_sj, which is what the user's session key is built from
+    SSK_j, Loc_j = record["SSK_j"], record["Loc_j"]
+
+    with trace.span("beta_check"):
+        h_val = hashlib.sha256((ID_j + SSK_j + T1).encode()).hexdigest()
+        UID_i_recovered = hex(int(alpha_i, 16) ^ int(h_val, 16))[2:].zfill(64)
+
+        beta_check = hashlib.sha256((UID_i_recovered + SSK_j + C_i + T1).encode()).hexdigest()
     if beta_check != beta_i:
+        trace.finish(403)
         return jsonify({"error": "β_i mismatch"}), 403
 
-    VT_ij = hashlib.sha256((UID_i_recovered + "location-verification").encode()).hexdigest()
-    h_comb = hashlib.sha256((C_i + UID_i_recovered + ID_j + beta_i).encode()).hexdigest()
-    gamma_i = hex(int(VT_ij + Loc_j.encode().hex(), 16) ^ int(h_comb, 16))[2:].zfill(64)
-    sigma_i = hashlib.sha256((VT_ij + C_i + str(int(T2) - int(T1))).encode()).hexdigest()
+    with trace.span("gamma_sigma"):
+        VT_ij = hashlib.sha256((UID_i_recovered + "location-verification").encode()).hexdigest()
+        h_comb = hashlib.sha256((C_i + UID_i_recovered + ID_j + beta_i).encode()).hexdigest()
+        gamma_i = hex(int(VT_ij + Loc_j.encode().hex(), 16) ^ int(h_comb, 16))[2:].zfill(64)
+        sigma_i = hashlib.sha256((VT_ij + C_i + str(int(T2) - int(T1))).encode()).hexdigest()
 
-    return jsonify({
+    trace.finish(200)
+    return wire.respond(request, "authenticate", {
         "gamma_i": gamma_i,
         "sigma_i": sigma_i,
         "T2": T2
-    }), 200
+    }, 200)
 
 
 
-@app.route('/update_server_db', methods=['POST'])
-def update_server_db():
+def send_heartbeat():
     T = str(int(time.time()))
     data = {
         "ID_j": ID_j,
         "T": T
     }
+    return requests.post(f"{RC_URL}/update_server_db", json=data, timeout=UPSTREAM_TIMEOUT)
 
+def _heartbeat_loop():
+    # Keeps this server in the RC's live List_sj
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
+        try:
+            send_heartbeat()
+        except requests.exceptions.RequestException as e:
+            print(f"Heartbeat to RC failed: {e}")
+
+@app.route('/update_server_db', methods=['POST'])
+def update_server_db():
     try:
-        response = requests.post(f"{RC_URL}/update_server_db", json=data)
+        response = send_heartbeat()
         if response.status_code == 200:
             return jsonify({"message": "Server record updated with RC"}), 200
         else:
@@ -134,13 +283,25 @@ def update_server_db():
 
 
 if __name__ == '__main__':
+    # app.run(debug=True) re-runs this file in a reloader child; only that child serves requests,
+    # so registration and the background threads must not also run in the watcher process
+    serving = os.environ.get("WERKZEUG_RUN_MAIN") == "true"
+
     # Attempt registration on startup (only if not already registered)
-    if not SSK_j:
+    if serving and not SSK_j:
         with app.app_context():
-            response = requests.post("http://localhost:5000/register_server") #Register with RC
-            if response.status_code != 200:
-                print ("There was an error reaching the server. Check the server URL")
-            else:
-                print ("There was a server. Registration Successful")
+            try:
+                response = requests.post("http://localhost:5000/register_server", timeout=UPSTREAM_TIMEOUT) #Register with RC
+                if response.status_code != 200:
+                    print ("There was an error reaching the server. Check the server URL")
+                else:
+                    print ("There was a server. Registration Successful")
+            except requests.exceptions.RequestException as e:
+                print(f"Could not reach the RC at startup: {e}")
+
+    if serving and HEARTBEAT_INTERVAL > 0:
+        threading.Thread(target=_heartbeat_loop, name="rc-heartbeat", daemon=True).start()
+    if serving and REPLICA_SYNC_INTERVAL > 0:
+        threading.Thread(target=_replica_loop, name="replica-sync", daemon=True).start()
 
-    app.run(port=5001, debug=True)
+    app.run(port=5001, debug=True, threaded=True)
@@ -0,0 +1,184 @@
+"""
+Binary smart-card format and memory-mapped card store.
+
+Card record (version 2), big-endian:
+
+    magic   b"SC"     2 bytes
+    version u8        1 byte
+    flags   u8        1 byte (reserved, 0)
+    W_i               64 bytes  (r1 || r2 is 64 ASCII bytes, so W_i is 512-bit)
+    X_i               32 bytes
+    Y_i               32 bytes
+    E_i               32 bytes
+    z_len   u32       4 bytes
+    Z_i               z_len bytes (List_sj-sized, at least 32)
+
+Version 1 records, identical except for a u16 z_len, are still read. That
+limit (64 KiB, roughly 800 servers in List_sj) is why version 2 exists.
+
+Container file: b"SCDB" + u8 version, followed by appended entries of
+`sha256(ID_i) (32 bytes) | u32 record length | record`. The store maps the
+file read-only and keeps an in-memory {key: offset} index, so loading a
+card is a slice of the mapping rather than a read + JSON parse + hex decode.
+Re-registering a user appends a new entry; the index points at the latest.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import threading
+from typing import NamedTuple
+
+CARD_MAGIC = b"SC"
+CARD_VERSION = 2
+STORE_MAGIC = b"SCDB"
+STORE_VERSION = 1
+
+_CARD_HEADERS = {
+    1: struct.Struct(">2sBB64s32s32s32sH"),
+    2: struct.Struct(">2sBB64s32s32s32sI"),
+}
+_CARD_HEADER = _CARD_HEADERS[CARD_VERSION]
+_STORE_HEADER = struct.Struct(">4sB")
+_ENTRY_HEADER = struct.Struct(">32sI")
+
+
+class SmartCard(NamedTuple):
+    W_i: int
+    X_i: int
+    Y_i: int
+    Z_i: int
+    E_i: bytes
+
+    @classmethod
+    def from_hex(cls, data):
+        """Build a card from the legacy {"W_i": hex, ...} JSON layout."""
+        return cls(int(data["W_i"], 16), int(data["X_i"], 16), int(data["Y_i"], 16),
+                   int(data["Z_i"], 16), bytes.fromhex(data["E_i"]))
+
+    def to_hex(self):
+        return {
+            "W_i": hex(self.W_i)[2:].zfill(64),
+            "X_i": hex(self.X_i)[2:].zfill(64),
+            "Y_i": hex(self.Y_i)[2:].zfill(64),
+            "Z_i": hex(self.Z_i)[2:].zfill(64),
+            "E_i": self.E_i.hex(),
+        }
+
+
+def pack_card(card):
+    z_len = max(32, (card.Z_i.bit_length() + 7) // 8)
+    return _CARD_HEADER.pack(
+        CARD_MAGIC, CARD_VERSION, 0,
+        card.W_i.to_bytes(64, "big"), card.X_i.to_bytes(32, "big"),
+        card.Y_i.to_bytes(32, "big"), card.E_i, z_len,
+    ) + card.Z_i.to_bytes(z_len, "big")
+
+
+def unpack_card(buf, offset=0):
+    magic, version = struct.unpack_from(">2sB", buf, offset)
+    header = _CARD_HEADERS.get(version)
+    if magic != CARD_MAGIC or header is None:
+        raise ValueError(f"Unsupported smart-card record (magic={magic!r}, version={version})")
+    _magic, _version, _flags, W_i, X_i, Y_i, E_i, z_len = header.unpack_from(buf, offset)
+    z_start = offset + header.size
+    with memoryview(buf) as view:
+        Z_i = int.from_bytes(view[z_start:z_start + z_len], "big")
+    return SmartCard(int.from_bytes(W_i, "big"), int.from_bytes(X_i, "big"),
+                     int.from_bytes(Y_i, "big"), Z_i, E_i)
+
+
+def card_key(ID_i):
+    return hashlib.sha256(ID_i.encode()).digest()
+
+
+class CardStore:
+    """Append-only container of binary cards, read through mmap."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._index = {}
+        self._mm = None
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, "wb") as f:
+                f.write(_STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION))
+        self._remap()
+        magic, version = _STORE_HEADER.unpack_from(self._mm, 0)
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+            raise ValueError(f"{path} is not a version {STORE_VERSION} smart-card store")
+        valid_end = self._scan(_STORE_HEADER.size)
+        if valid_end < len(self._mm):
+            # Drop a torn trailing entry so later appends stay aligned
+            self._mm.close()
+            self._mm = None
+            os.truncate(path, valid_end)
+            self._remap()
+
+    def _remap(self):
+        if self._mm is not None:
+            self._mm.close()
+        with open(self.path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _scan(self, offset):
+        end = len(self._mm)
+        while offset + _ENTRY_HEADER.size <= end:
+            key, length = _ENTRY_HEADER.unpack_from(self._mm, offset)
+            record_offset = offset + _ENTRY_HEADER.size
+            if record_offset + length > end:
+                break
+            self._index[key] = record_offset
+            offset = record_offset + length
+        return offset
+
+    def get(self, ID_i):
+        with self._lock:
+            offset = self._index.get(card_key(ID_i))
+            if offset is None:
+                return None
+            return unpack_card(self._mm, offset)
+
+    def put(self, ID_i, card):
+        record = pack_card(card)
+        key = card_key(ID_i)
+        with self._lock:
+            with open(self.path, "ab") as f:
+                offset = f.tell()
+                f.write(_ENTRY_HEADER.pack(key, len(record)) + record)
+                f.flush()
+                os.fsync(f.fileno())
+            self._remap()
+            self._index[key] = offset + _ENTRY_HEADER.size
+
+
+if __name__ == "__main__":
+    # Round-trip self-check: python smartcard.py
+    import secrets
+    import tempfile
+
+    def random_card(z_bytes):
+        return SmartCard(int.from_bytes(secrets.token_hex(32).encode(), "big"), secrets.randbits(256),
+                         secrets.randbits(256), int.from_bytes(secrets.token_bytes(z_bytes), "big") | 1 << (z_bytes * 8 - 1),
+                         secrets.token_bytes(32))
+
+    # A List_sj of ~2,000 servers is well past the old u16 z_len limit
+    cards = {"small": random_card(40), "large": random_card(200_000)}
+    for name, card in cards.items():
+        assert unpack_card(pack_card(card)) == card, f"{name} card did not round-trip"
+    legacy = _CARD_HEADERS[1].pack(CARD_MAGIC, 1, 0, cards["small"].W_i.to_bytes(64, "big"),
+                                   cards["small"].X_i.to_bytes(32, "big"), cards["small"].Y_i.to_bytes(32, "big"),
+                                   cards["small"].E_i, 40) + cards["small"].Z_i.to_bytes(40, "big")
+    assert unpack_card(legacy) == cards["small"], "version 1 record did not decode"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cards.bin")
+        store = CardStore(path)
+        for name, card in cards.items():
+            store.put(name, card)
+        reopened = CardStore(path)
+        assert all(reopened.get(name) == card for name, card in cards.items()), "store did not round-trip"
+        store._mm.close()
+        reopened._mm.close()
+    print("smartcard round-trip OK")
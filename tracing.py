@@ -0,0 +1,200 @@
+"""
+Lightweight request tracing for the RC, hospital server and middleware.
+
+A trace is a set of named phase timings (spans) for one request. Traces are
+sampled at TRACE_SAMPLE_RATE (0.0 - 1.0, default 0 = off) and exported
+asynchronously: the request thread only puts a record on a queue, and a
+background listener writes it to TRACE_LOG_FILE.
+
+Only span names and durations are exported, never protocol values (keys,
+UIDs, hashes), so enabling tracing in production does not leak secrets.
+
+Cross-service correlation: the middleware sends an X-Request-ID with each
+call to the RC and hospital server (CORRELATE_REQUESTS, default on). A
+request carrying that header from a peer in SERVER_TIMING_PEERS is always
+timed, whether or not it is sampled for export. Its phases are returned
+in a standard Server-Timing response header, so the caller can log one
+combined breakdown per request. Other callers never get phase timings
+(beta_check included), whatever headers they send.
+
+Cost: a correlated or sampled request builds a Trace (a list of span
+tuples, plus a Server-Timing header on the RC/server). Only requests that
+are neither get NULL_TRACE, whose methods do nothing. With the middleware
+correlating every request, that is none of them, unless
+CORRELATE_REQUESTS=0.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0"))
+TRACE_LOG_FILE = os.environ.get("TRACE_LOG_FILE", "trace.log")
+REQUEST_ID_HEADER = "X-Request-ID"
+TIMING_HEADER = "Server-Timing"
+_REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+# Send X-Request-ID from the middleware; 0 restores the NULL_TRACE fast path on every service
+CORRELATE_REQUESTS = os.environ.get("CORRELATE_REQUESTS", "1") != "0"
+# Peers allowed to ask for Server-Timing phase breakdowns (normally just the middleware's host)
+SERVER_TIMING_PEERS = {addr.strip() for addr in os.environ.get("SERVER_TIMING_PEERS", "127.0.0.1,::1").split(",")
+                       if addr.strip()}
+
+_trace_logger = logging.getLogger("trace")
+_trace_logger.setLevel(logging.INFO)
+_trace_logger.propagate = False
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def _get_exporter():
+    """Start the background export thread on first use."""
+    global _listener
+    if _listener is None:
+        with _listener_lock:
+            if _listener is None:
+                export_queue = queue.SimpleQueue()
+                file_handler = logging.FileHandler(TRACE_LOG_FILE)
+                file_handler.setFormatter(logging.Formatter('%(asctime)s | %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
+                _trace_logger.addHandler(logging.handlers.QueueHandler(export_queue))
+                _listener = logging.handlers.QueueListener(export_queue, file_handler)
+                _listener.start()
+                atexit.register(_listener.stop)
+    return _trace_logger
+
+
+class _Span:
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.record(self.name, (time.perf_counter() - self.start) * 1000)
+        return False
+
+
+class Trace:
+    """Per-request span collector."""
+
+    __slots__ = ("service", "operation", "trace_id", "sampled", "share_timings", "start", "spans")
+
+    def __init__(self, service, operation, trace_id=None, sampled=True, share_timings=False):
+        self.service = service
+        self.operation = operation
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.sampled = sampled
+        self.share_timings = share_timings
+        self.start = time.perf_counter()
+        self.spans = []
+
+    def span(self, name):
+        return _Span(self, name)
+
+    def record(self, name, duration_ms):
+        self.spans.append((name, duration_ms))
+
+    def timing_headers(self):
+        if not self.share_timings:
+            return {}
+        total = (time.perf_counter() - self.start) * 1000
+        metrics = [f"{name};dur={ms:.3f}" for name, ms in self.spans]
+        metrics.append(f"total;dur={total:.3f}")
+        return {REQUEST_ID_HEADER: self.trace_id, TIMING_HEADER: ", ".join(metrics)}
+
+    def finish(self, status=200):
+        if not self.sampled:
+            return
+        total = (time.perf_counter() - self.start) * 1000
+        phases = " | ".join(f"{name}={ms:.3f}ms" for name, ms in self.spans)
+        _get_exporter().info(
+            f"TRACE | service={self.service} | op={self.operation} | trace_id={self.trace_id} | "
+            f"status={status} | {phases + ' | ' if phases else ''}TOTAL={total:.3f}ms"
+        )
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _NullTrace:
+    """Returned for unsampled requests; every method is a no-op."""
+
+    __slots__ = ()
+    trace_id = None
+    _span = _NullSpan()
+
+    def span(self, name):
+        return self._span
+
+    def record(self, name, duration_ms):
+        pass
+
+    def timing_headers(self):
+        return {}
+
+    def finish(self, status=200):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+def start_trace(service, operation, trace_id=None):
+    """
+    Return a Trace for sampled requests and for requests carrying a
+    correlation ID (`trace_id`), NULL_TRACE otherwise. Only sampled
+    traces are exported to TRACE_LOG_FILE, and only correlated ones
+    return Server-Timing headers.
+    """
+    sampled = TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+    if not sampled and trace_id is None:
+        return NULL_TRACE
+    return Trace(service, operation, trace_id, sampled, share_timings=trace_id is not None)
+
+
+def new_request_id():
+    """Correlation ID for an outgoing middleware request, or None when CORRELATE_REQUESTS is off."""
+    return uuid.uuid4().hex if CORRELATE_REQUESTS else None
+
+
+def request_id_from(headers, remote_addr):
+    """Return the caller's X-Request-ID if the peer may see timings and the ID is safe to log, else None."""
+    if remote_addr not in SERVER_TIMING_PEERS:
+        return None
+    value = headers.get(REQUEST_ID_HEADER)
+    if value and _REQUEST_ID_PATTERN.fullmatch(value):
+        return value
+    return None
+
+
+def parse_server_timing(header):
+    """Parse a Server-Timing header into {metric: duration_ms}."""
+    timings = {}
+    for metric in (header or "").split(","):
+        name, _, params = metric.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur" and name:
+                try:
+                    timings[name] = float(value)
+                except ValueError:
+                    pass
+    return timings
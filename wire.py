@@ -0,0 +1,207 @@
+"""
+Content-negotiated wire encodings for protocol messages.
+
+JSON stays the default. Two compact alternatives are available for
+/authenticate, /register_user and /register_server:
+
+- application/vnd.sop.v1+binary: a fixed-layout struct per message. Hash
+  fields travel as raw 32-byte values instead of 64 hex characters, and
+  timestamps as u64. There are no field names and no parsing beyond
+  struct.unpack.
+- application/msgpack: generic msgpack, used only when the optional
+  `msgpack` package is installed.
+
+A request's Content-Type selects how its body is decoded. Its Accept
+header selects the response encoding. Error responses are always JSON.
+"""
+
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_CONTENT_TYPE = "application/json"
+BINARY_CONTENT_TYPE = "application/vnd.sop.v1+binary"
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+CONTENT_TYPES = {"json": JSON_CONTENT_TYPE, "binary": BINARY_CONTENT_TYPE, "msgpack": MSGPACK_CONTENT_TYPE}
+AVAILABLE_FORMATS = ("json", "binary") + (("msgpack",) if msgpack is not None else ())
+
+WIRE_MAGIC = b"W"
+WIRE_VERSION = 1
+
+# Field kinds:
+#   h32     64-char hex digest        -> 32 raw bytes
+#   hexint  variable-length hex value -> u16 length + big-endian bytes (zfill(64) on decode)
+#   ts      decimal timestamp string  -> u64
+#   u32     integer                   -> u32
+#   str     text                      -> u16 length + UTF-8
+#   strlist list of text              -> u16 count + str entries
+SCHEMAS = {
+    "authenticate_request": (1, [("alpha_i", "h32"), ("beta_i", "h32"), ("T1", "ts"), ("C_i", "h32"),
+                                 ("UID_i", "h32"), ("ID_j", "str")]),
+    "authenticate_response": (2, [("gamma_i", "hexint"), ("sigma_i", "h32"), ("T2", "ts")]),
+    "register_user_request": (3, [("UID_i", "h32"), ("A_i", "h32")]),
+    "register_user_response": (4, [("C_i", "h32"), ("D_i", "h32"), ("List_sj", "strlist"),
+                                   ("List_sj_version", "u32")]),
+    "register_server_request": (5, [("ID_j", "str"), ("P_j", "h32"), ("Q_j", "h32"), ("Loc_j", "str")]),
+    "register_server_response": (6, [("SSK_j", "h32")]),
+}
+
+_HEADER = struct.Struct(">1sBB")
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+_U64 = struct.Struct(">Q")
+
+
+def _pack_str(value, out):
+    raw = value.encode("utf-8")
+    out += _U16.pack(len(raw))
+    out += raw
+
+
+def encode_binary(schema, payload):
+    message_id, fields = SCHEMAS[schema]
+    out = bytearray(_HEADER.pack(WIRE_MAGIC, WIRE_VERSION, message_id))
+    for name, kind in fields:
+        value = payload[name]
+        if kind == "h32":
+            raw = bytes.fromhex(value)
+            if len(raw) != 32:
+                raise ValueError(f"{name} must be 32 bytes of hex")
+            out += raw
+        elif kind == "hexint":
+            number = int(value, 16)
+            raw = number.to_bytes(max(1, (number.bit_length() + 7) // 8), "big")
+            out += _U16.pack(len(raw))
+            out += raw
+        elif kind == "ts":
+            out += _U64.pack(int(value))
+        elif kind == "u32":
+            out += _U32.pack(int(value))
+        elif kind == "str":
+            _pack_str(value, out)
+        elif kind == "strlist":
+            out += _U16.pack(len(value))
+            for entry in value:
+                _pack_str(entry, out)
+    return bytes(out)
+
+
+def decode_binary(schema, body):
+    message_id, fields = SCHEMAS[schema]
+    try:
+        magic, version, received_id = _HEADER.unpack_from(body, 0)
+        if magic != WIRE_MAGIC or version != WIRE_VERSION or received_id != message_id:
+            raise ValueError(f"Not a v{WIRE_VERSION} {schema} message")
+        offset = _HEADER.size
+        payload = {}
+        for name, kind in fields:
+            if kind == "h32":
+                payload[name] = body[offset:offset + 32].hex()
+                if len(payload[name]) != 64:
+                    raise ValueError(f"Truncated field {name}")
+                offset += 32
+            elif kind in ("hexint", "str"):
+                (length,) = _U16.unpack_from(body, offset)
+                raw = body[offset + 2:offset + 2 + length]
+                if len(raw) != length:
+                    raise ValueError(f"Truncated field {name}")
+                payload[name] = hex(int.from_bytes(raw, "big"))[2:].zfill(64) if kind == "hexint" else raw.decode("utf-8")
+                offset += 2 + length
+            elif kind == "ts":
+                payload[name] = str(_U64.unpack_from(body, offset)[0])
+                offset += 8
+            elif kind == "u32":
+                payload[name] = _U32.unpack_from(body, offset)[0]
+                offset += 4
+            elif kind == "strlist":
+                (count,) = _U16.unpack_from(body, offset)
+                offset += 2
+                entries = []
+                for _ in range(count):
+                    (length,) = _U16.unpack_from(body, offset)
+                    raw = body[offset + 2:offset + 2 + length]
+                    if len(raw) != length:
+                        raise ValueError(f"Truncated field {name}")
+                    entries.append(raw.decode("utf-8"))
+                    offset += 2 + length
+                payload[name] = entries
+        if offset != len(body):
+            raise ValueError(f"{len(body) - offset} trailing bytes after {schema} message")
+        return payload
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"Malformed {schema} message: {e}")
+
+
+def check_format(fmt):
+    """Validate a configured WIRE_FORMAT at startup, so a missing msgpack fails fast instead of per request."""
+    if fmt not in AVAILABLE_FORMATS:
+        hint = " (install the msgpack package)" if fmt == "msgpack" else ""
+        raise ValueError(f"WIRE_FORMAT={fmt!r} is not available{hint}; choose one of {', '.join(AVAILABLE_FORMATS)}")
+    return fmt
+
+
+def encode(fmt, schema, payload):
+    if fmt == "binary":
+        return encode_binary(schema, payload)
+    if fmt == "msgpack":
+        if msgpack is None:
+            raise ValueError("msgpack is not installed")
+        return msgpack.packb(payload)
+    return json.dumps(payload).encode()
+
+
+def decode(fmt, schema, body):
+    if fmt == "binary":
+        return decode_binary(schema, body)
+    if fmt == "msgpack":
+        if msgpack is None:
+            raise ValueError("msgpack is not installed")
+        payload = msgpack.unpackb(body)
+    else:
+        payload = json.loads(body)
+    if not isinstance(payload, dict):
+        raise ValueError("Message body must be an object")
+    return payload
+
+
+def format_of(content_type):
+    """Map a Content-Type (or Accept) header to 'binary', 'msgpack' or 'json'."""
+    content_type = (content_type or "").lower()
+    if BINARY_CONTENT_TYPE in content_type:
+        return "binary"
+    if MSGPACK_CONTENT_TYPE in content_type and msgpack is not None:
+        return "msgpack"
+    return "json"
+
+
+# ====================== FLASK (server side) ======================
+def read_request(req, schema):
+    """Decode a Flask request body according to its Content-Type. Raises ValueError."""
+    return decode(format_of(req.content_type), f"{schema}_request", req.get_data())
+
+
+def respond(req, schema, payload, status):
+    """Encode a success response in the format the caller accepts."""
+    from flask import Response
+    fmt = format_of(req.headers.get("Accept"))
+    return Response(encode(fmt, f"{schema}_response", payload), status=status, content_type=CONTENT_TYPES[fmt])
+
+
+# ====================== CLIENT ======================
+def request_kwargs(fmt, schema, payload):
+    """requests.post() keyword arguments sending `payload` in `fmt` and asking for the same back."""
+    content_type = CONTENT_TYPES[fmt]
+    return {
+        "data": encode(fmt, f"{schema}_request", payload),
+        "headers": {"Content-Type": content_type, "Accept": content_type},
+    }
+
+
+def read_response(response, schema):
+    """Decode a requests.Response; error bodies fall back to JSON."""
+    fmt = format_of(response.headers.get("Content-Type"))
+    return decode(fmt, f"{schema}_response", response.content)